@@ -1,22 +1,17 @@
 import streamlit as st
+import streamlit.components.v1 as components
 import os
+import html
+import shutil
 import tempfile
 from pathlib import Path
-import fitz  # PyMuPDF
-from docx import Document
 import base64
-from io import BytesIO
 import time
-from PIL import Image
-import pandas as pd
-import zipfile
-import subprocess
-import sys
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.utils import ImageReader
-from pptx import Presentation
-from pptx.util import Inches
+import backends
+import docs
+import governor
+import results
+import uploads
 
 # Set page configuration
 st.set_page_config(
@@ -83,6 +78,16 @@ st.markdown("""
         background: linear-gradient(135deg, #6a11cb 0%, #2575fc 100%);
         color: white;
     }
+    .download-link {
+        display: block;
+        text-align: center;
+        border-radius: 5px;
+        padding: 0.75rem;
+        font-weight: bold;
+        background: linear-gradient(135deg, #6a11cb 0%, #2575fc 100%);
+        color: white !important;
+        text-decoration: none;
+    }
     .footer {
         text-align: center;
         margin-top: 2rem;
@@ -105,134 +110,179 @@ st.markdown("""
 os.makedirs("temp", exist_ok=True)
 os.makedirs("output", exist_ok=True)
 
-def save_uploaded_file(uploaded_file, directory="temp"):
-    """Save uploaded file to directory and return file path"""
+# Start the warm conversion workers and the large-file upload server once per server process
+governor.start_workers()
+upload_port = uploads.start_server()
+
+def run_conversion(operation, sources, *args, **kwargs):
+    """Run a converter under the resource governor (admission control + sandbox)
+
+    The result is written straight to the results directory and returned as a
+    StoredFile, so the session only holds its path.
+    """
+    # Conversions with several engines dispatch through backends.py
+    converter = getattr(backends, operation, None) or getattr(docs, operation)
+    result_path = results.new_result_path(session_inbox())
     try:
-        file_path = os.path.join(directory, uploaded_file.name)
-        with open(file_path, "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        return file_path
+        governor.run_governed(
+            operation,
+            converter,
+            sources,
+            *args,
+            on_queue=lambda cost: st.info(f"⏳ Large job (estimated cost {cost}) is queued until a worker is free..."),
+            result_path=result_path,
+            **kwargs,
+        )
+    except BaseException:
+        shutil.rmtree(os.path.dirname(result_path), ignore_errors=True)
+        raise
+    return uploads.StoredFile(result_path)
+
+def server_base_url():
+    """Address of the upload and download server as seen from this browser, or None if it cannot reach it"""
+    if upload_port is None:
+        return None
+    host = st.context.headers.get("Host", "localhost").rsplit(":", 1)[0]
+    return uploads.base_url(host, upload_port)
+
+def download_result(label, data, file_name, mime):
+    """Download link for a result stored on disk
+
+    The file is streamed by the download server (with resume support), so it
+    is never held in the session. When this browser cannot reach that server
+    it falls back to a download button fed from the file.
+    """
+    base_url = server_base_url()
+    if base_url is None:
+        with open(data, "rb") as f:
+            st.download_button(label=label, data=f, file_name=file_name, mime=mime)
+        return
+    url = results.result_url(data, base_url, file_name)
+    st.markdown(
+        f'<a class="download-link" href="{html.escape(url)}" download="{html.escape(file_name)}">{label}</a>',
+        unsafe_allow_html=True
+    )
+    st.caption(f"{data.size / 1024:.2f} KB · available for {results.RESULT_TTL // 60} minutes")
+
+OUTPUT_PROFILE_LABELS = {
+    "standard": "Standard",
+    "web": "Fast web view (linearized)",
+    "compact": "Smallest file (object and xref streams)",
+}
+
+def output_options_input():
+    """Output profile controls for tools that save a PDF"""
+    profile = st.selectbox(
+        "Output profile",
+        list(OUTPUT_PROFILE_LABELS),
+        format_func=OUTPUT_PROFILE_LABELS.get,
+        help="Fast web view lets browsers show page one before the whole file has downloaded"
+    )
+    strip_metadata = st.checkbox("Strip document metadata (title, author, XMP)")
+    return {"profile": profile, "strip_metadata": strip_metadata}
+
+def show_output_report(pdf_result):
+    """Show the size and first-page cost of a generated PDF, measured in a sandboxed worker"""
+    try:
+        report = governor.run_spooled(docs.describe_output, pdf_result)
     except Exception as e:
-        st.error(f"Error saving file: {str(e)}")
+        st.warning(f"Could not measure the output: {str(e)}")
+        return
+    st.write("**Output details:**")
+    st.json({
+        "File size": f"{report['size'] / 1024:.2f} KB",
+        "Fast web view": "Yes" if report["linearized"] else "No",
+        "Download needed for first page": f"{report['first_page_bytes'] / 1024:.2f} KB",
+        "Time to first page": f"{report['first_page_ms']:.1f} ms"
+    })
+
+STAMP_POSITION_LABELS = {
+    "diagonal": "Diagonal across the page",
+    "top": "Top of the page",
+    "bottom": "Bottom of the page",
+}
+
+def stamp_options_input(key="stamp"):
+    """Watermark and numbering controls; returns keyword arguments for docs.stamp_document"""
+    text = st.text_input("Watermark or stamp text", value="CONFIDENTIAL", key=f"{key}_text")
+    options = {}
+    if text.strip():
+        col1, col2 = st.columns(2)
+        with col1:
+            options["position"] = st.selectbox("Position", list(STAMP_POSITION_LABELS),
+                                               format_func=STAMP_POSITION_LABELS.get, key=f"{key}_position")
+            options["opacity"] = st.slider("Opacity", min_value=0.05, max_value=1.0, value=0.25, step=0.05,
+                                           key=f"{key}_opacity")
+        with col2:
+            options["color"] = st.color_picker("Colour", value="#ff0000", key=f"{key}_color")
+        options["text"] = text.strip()
+
+    numbering = st.radio("Numbering", ["None", "Page numbers", "Bates numbers"], horizontal=True,
+                         key=f"{key}_numbering")
+    if numbering != "None":
+        if numbering == "Page numbers":
+            options["number_format"] = st.text_input(
+                "Number format", value="Page {n} of {total}", key=f"{key}_format",
+                help="{n} is the page number and {total} the number of stamped pages"
+            )
+        else:
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                prefix = st.text_input("Prefix", value="DOC", key=f"{key}_prefix")
+            with col2:
+                digits = st.number_input("Digits", min_value=1, max_value=12, value=6, key=f"{key}_digits")
+            with col3:
+                options["start_number"] = st.number_input("First number", min_value=0, value=1,
+                                                          key=f"{key}_start")
+            options["number_format"] = prefix.replace("{", "{{").replace("}", "}}") + "{n:0%dd}" % digits
+        options["number_position"] = st.selectbox("Number position", list(docs.NUMBER_POSITIONS),
+                                                  key=f"{key}_number_position")
+    return options
+
+def backend_input(conversion):
+    """Engine picker for conversions that have several backends; returns None for automatic"""
+    installed = backends.available_backends(conversion)
+    if len(installed) < 2:
         return None
+    auto_label = f"Automatic ({backends.choose_backend(conversion)})"
+    choice = st.selectbox(
+        "Conversion engine",
+        [auto_label] + installed,
+        help="Automatic picks the fastest installed engine measured by `python cli.py benchmark`"
+    )
+    return None if choice == auto_label else choice
 
-def pdf_to_word(pdf_file):
+def page_selection_input(key=None):
+    """Text box for a page selection such as "1-5,8,10-"; returns None for all pages"""
+    pages = st.text_input(
+        "Pages (optional)",
+        placeholder="e.g. 1-5,8,10-",
+        help="Only these pages are processed. Leave empty to process the whole document.",
+        key=key
+    )
+    return pages.strip() or None
+
+def pdf_to_word(pdf_file, pages=None, backend=None):
     """Convert PDF file to Word document"""
     try:
-        # Create a new Word document
-        doc = Document()
-        
-        # Open the PDF file
-        pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        
-        # Process each page
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            
-            # Extract text
-            text = page.get_text()
-            
-            # Add text to Word document
-            if text.strip():
-                doc.add_paragraph(text)
-        
-        pdf_document.close()
-        
-        # Save to BytesIO buffer
-        buffer = BytesIO()
-        doc.save(buffer)
-        buffer.seek(0)
-        
-        return buffer
-        
+        return run_conversion("pdf_to_word", pdf_file, pages=pages, backend=backend)
     except Exception as e:
         st.error(f"Error converting PDF: {str(e)}")
         return None
 
-def word_to_pdf(docx_file):
-    """Convert Word document to PDF using LibreOffice (cross-platform)"""
+def word_to_pdf(docx_file, backend=None):
+    """Convert Word document to PDF (LibreOffice, Aspose.Words, MS Word or a text-only fallback)"""
     try:
-        # Save the uploaded file
-        docx_path = save_uploaded_file(docx_file)
-        if not docx_path:
-            return None
-        
-        # Create output path
-        pdf_path = docx_path.replace('.docx', '.pdf').replace('.doc', '.pdf')
-        
-        # Convert using LibreOffice
-        if sys.platform == "win32":
-            # Windows
-            cmd = f'soffice --headless --convert-to pdf "{docx_path}" --outdir "{os.path.dirname(docx_path)}"'
-        else:
-            # Linux/Mac
-            cmd = f'libreoffice --headless --convert-to pdf "{docx_path}" --outdir "{os.path.dirname(docx_path)}"'
-        
-        subprocess.run(cmd, shell=True, check=True)
-        
-        # Read the generated PDF
-        with open(pdf_path, 'rb') as f:
-            pdf_data = f.read()
-        
-        # Clean up temporary files
-        os.unlink(docx_path)
-        if os.path.exists(pdf_path):
-            os.unlink(pdf_path)
-        
-        return BytesIO(pdf_data)
-        
+        return run_conversion("word_to_pdf", docx_file, backend=backend)
     except Exception as e:
         st.error(f"Error converting Word to PDF: {str(e)}")
         st.info("Please make sure LibreOffice is installed on your system.")
         return None
 
-def pdf_to_pptx(pdf_file):
+def pdf_to_pptx(pdf_file, pages=None):
     """Convert PDF to PowerPoint presentation"""
     try:
-        # Open the PDF file
-        pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        
-        # Create a new PowerPoint presentation
-        prs = Presentation()
-        
-        # Add a title slide
-        title_slide_layout = prs.slide_layouts[0]
-        slide = prs.slides.add_slide(title_slide_layout)
-        title = slide.shapes.title
-        subtitle = slide.placeholders[1]
-        
-        title.text = "PDF Conversion"
-        subtitle.text = f"Converted from {pdf_file.name}"
-        
-        # Process each page and add as a new slide
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            
-            # Extract text
-            text = page.get_text()
-            
-            # Add a new slide for each page
-            blank_slide_layout = prs.slide_layouts[6]
-            slide = prs.slides.add_slide(blank_slide_layout)
-            
-            # Add text box
-            left = Inches(0.5)
-            top = Inches(1)
-            width = Inches(9)
-            height = Inches(6)
-            txBox = slide.shapes.add_textbox(left, top, width, height)
-            tf = txBox.text_frame
-            tf.text = text
-        
-        pdf_document.close()
-        
-        # Save to BytesIO buffer
-        buffer = BytesIO()
-        prs.save(buffer)
-        buffer.seek(0)
-        
-        return buffer
-        
+        return run_conversion("pdf_to_pptx", pdf_file, pages=pages)
     except Exception as e:
         st.error(f"Error converting PDF to PowerPoint: {str(e)}")
         return None
@@ -240,268 +290,214 @@ def pdf_to_pptx(pdf_file):
 def pdf_to_jpg(pdf_file, page_number=0):
     """Convert PDF page to JPG image"""
     try:
-        # Open the PDF file
-        pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        
-        # Get the specified page
-        if page_number >= len(pdf_document):
-            page_number = 0
-            
-        page = pdf_document.load_page(page_number)
-        
-        # Convert to image
-        pix = page.get_pixmap(matrix=fitz.Matrix(2, 2))
-        img_data = pix.tobytes("jpeg")
-        
-        pdf_document.close()
-        
-        return BytesIO(img_data)
-        
+        return run_conversion("pdf_to_jpg", pdf_file, page_number)
     except Exception as e:
         st.error(f"Error converting PDF to JPG: {str(e)}")
         return None
 
-def jpg_to_pdf(image_files):
-    """Convert JPG images to PDF"""
+def pdf_pages_to_jpg(pdf_file, pages=None):
+    """Convert the selected PDF pages to JPG images in a ZIP"""
     try:
-        # Create a new PDF
-        buffer = BytesIO()
-        c = canvas.Canvas(buffer, pagesize=letter)
-        width, height = letter
-        
-        for img_file in image_files:
-            # Open image
-            img = Image.open(img_file)
-            img.thumbnail((width - 100, height - 100))  # Resize to fit page
-            
-            # Convert to PDF page
-            img_buffer = BytesIO()
-            img.save(img_buffer, format='JPEG')
-            img_buffer.seek(0)
-            
-            # Add to PDF
-            c.drawImage(ImageReader(img_buffer), 50, 50, width=img.width, height=img.height)
-            c.showPage()
-        
-        c.save()
-        buffer.seek(0)
-        
-        return buffer
-        
+        return run_conversion("pdf_pages_to_jpg", pdf_file, pages=pages)
+    except Exception as e:
+        st.error(f"Error converting PDF to JPG: {str(e)}")
+        return None
+
+def extract_images(pdf_file, pages=None, min_width=0, min_height=0, min_bytes=0):
+    """Extract the embedded images of a PDF into a ZIP"""
+    try:
+        return run_conversion("extract_images", pdf_file, pages=pages, min_width=min_width,
+                              min_height=min_height, min_bytes=min_bytes)
+    except Exception as e:
+        st.error(f"Error extracting images: {str(e)}")
+        return None
+
+def jpg_to_pdf(image_files, include=None, exclude=None):
+    """Convert images to PDF, one per page"""
+    try:
+        return run_conversion("jpg_to_pdf", list(image_files), include, exclude)
     except Exception as e:
         st.error(f"Error converting JPG to PDF: {str(e)}")
         return None
 
-def pdf_to_excel(pdf_file):
+def pdf_to_excel(pdf_file, pages=None):
     """Convert PDF to Excel"""
     try:
-        # Open the PDF file
-        pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        
-        # Extract text
-        text_content = ""
-        for page_num in range(len(pdf_document)):
-            page = pdf_document.load_page(page_num)
-            text_content += page.get_text() + "\n"
-        
-        pdf_document.close()
-        
-        # Create a DataFrame with the text
-        df = pd.DataFrame({"Extracted Text": text_content.split("\n")})
-        
-        # Save to BytesIO buffer
-        buffer = BytesIO()
-        with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False)
-        buffer.seek(0)
-        
-        return buffer
-        
+        return run_conversion("pdf_to_excel", pdf_file, pages=pages)
     except Exception as e:
         st.error(f"Error converting PDF to Excel: {str(e)}")
         return None
 
+def pdf_to_text(pdf_file, text_format="markdown", pages=None):
+    """Export the text of a PDF as Markdown, JSON Lines or plain text"""
+    try:
+        return run_conversion("pdf_to_text", pdf_file, text_format, pages=pages)
+    except Exception as e:
+        st.error(f"Error exporting text: {str(e)}")
+        return None
 
 
 
 
-# def excel_to_pdf(excel_file):
-#     """Convert Excel to PDF using LibreOffice (no hardcoded path)"""
-#     try:
-#         # Save uploaded Excel file
-#         excel_path = save_uploaded_file(excel_file)
-#         if not excel_path:
-#             return None
 
-#         # Output PDF path
-#         pdf_path = excel_path.rsplit(".", 1)[0] + ".pdf"
+def excel_to_pdf(excel_file, backend=None):
+    """Convert Excel to PDF (LibreOffice, Aspose.Cells or a values-only fallback)"""
+    try:
+        return run_conversion("excel_to_pdf", excel_file, backend=backend)
+    except Exception as e:
+        st.error(f"Error converting Excel to PDF: {str(e)}")
+        st.info("Make sure LibreOffice is installed and added to your PATH.")
+        return None
 
-#         # Choose command based on OS
-#         cmd = (
-#             f'soffice --headless --convert-to pdf:calc_pdf_Export "{excel_path}" --outdir "{os.path.dirname(excel_path)}"'
-#             if sys.platform == "win32"
-#             else f'libreoffice --headless --convert-to pdf:calc_pdf_Export "{excel_path}" --outdir "{os.path.dirname(excel_path)}"'
-#         )
+def merge_pdfs(pdf_files, output=None, include=None, exclude=None):
+    """Merge multiple PDF files into one"""
+    try:
+        return run_conversion("merge_pdfs", list(pdf_files), output, include, exclude)
+    except Exception as e:
+        st.error(f"Error merging PDFs: {str(e)}")
+        return None
 
-#         # Run command and capture logs
-#         result = subprocess.run(cmd, shell=True, capture_output=True, text=True)
-#         if result.returncode != 0:
-#             raise Exception(f"LibreOffice error:\n{result.stderr}")
+def split_pdf(pdf_file, split_type="single", start_page=1, end_page=1, pages=None, output=None):
+    """Split a PDF file into multiple files"""
+    try:
+        return run_conversion("split_pdf", pdf_file, split_type, start_page, end_page, pages=pages, output=output)
+    except Exception as e:
+        st.error(f"Error splitting PDF: {str(e)}")
+        return None
 
-#         # Read PDF
-#         with open(pdf_path, "rb") as f:
-#             pdf_data = f.read()
+def compress_pdf(pdf_file, compression_level=3, pages=None, output=None):
+    """Compress a PDF file by recompressing images and optimizing storage"""
+    try:
+        return run_conversion("compress_pdf", pdf_file, compression_level, pages=pages, output=output)
+    except Exception as e:
+        st.error(f"Error compressing PDF: {str(e)}")
+        return None
 
-#         # Cleanup
-#         os.unlink(excel_path)
-#         os.unlink(pdf_path)
+def stamp_pdf(pdf_file, pages=None, **options):
+    """Add a watermark and/or page or Bates numbers to a PDF"""
+    try:
+        return run_conversion("stamp_pdf", pdf_file, pages=pages, **options)
+    except Exception as e:
+        st.error(f"Error stamping PDF: {str(e)}")
+        return None
 
-#         return BytesIO(pdf_data)
+def organize_pages(pdf_file, order=None, rotate=None, delete=None, output=None):
+    """Reorder, rotate, delete or extract pages of a PDF"""
+    try:
+        return run_conversion("organize_pages", pdf_file, order, rotate, delete, output)
+    except Exception as e:
+        st.error(f"Error organizing pages: {str(e)}")
+        return None
 
-#     except Exception as e:
-#         st.error(f"Error converting Excel to PDF: {str(e)}")
-#         st.info("Make sure LibreOffice is installed and added to your PATH.")
-#         return None
+def compare_pdfs(old_file, new_file, report="pdf", pixel_diff=False):
+    """Compare two revisions of a PDF"""
+    try:
+        return run_conversion("compare_pdfs", [old_file, new_file], report, pixel_diff)
+    except Exception as e:
+        st.error(f"Error comparing PDFs: {str(e)}")
+        return None
 
+def run_pdf_pipeline(pdf_files, steps, output=None):
+    """Run a recipe of PDF operations, parsing the inputs and saving the result once"""
+    try:
+        return run_conversion("run_pipeline", list(pdf_files), steps, output)
+    except Exception as e:
+        st.error(f"Error running pipeline: {str(e)}")
+        return None
 
+st.sidebar.header("Made By Subhadip 😎")
 
+def session_inbox():
+    """Inbox for this session's large uploads and results
 
+    It is kept in the session rather than the URL, so sharing a link to the
+    app does not share this session's files.
+    """
+    inbox = st.session_state.get("inbox")
+    if not uploads.is_inbox(inbox):
+        inbox = st.session_state["inbox"] = uploads.new_inbox()
+    return inbox
 
+def large_file_input(types, multiple=False, key=None):
+    """Pick files sent through the resumable large-file upload page
 
+    They stay on disk and are handed to converters as paths, so they are never
+    loaded into memory. Returns a StoredFile (or a list with multiple=True).
+    key tells apart several pickers in one tool.
+    """
+    base_url = server_base_url()
+    if base_url is None:
+        return [] if multiple else None
+    page_url = f"{base_url}/{session_inbox()}/"
 
+    with st.expander("📦 Large files"):
+        st.markdown(
+            f"Files over {governor.MAX_FILE_SIZE // governor.MB} MB: send them through the "
+            f"[large-file upload page]({page_url}) (resumable, up to {governor.MAX_UPLOAD_SIZE // governor.MB} MB), "
+            "then choose them here."
+        )
+        stored = {f.path: f for f in uploads.list_uploads(session_inbox(), ["." + t for t in types])}
+        label = lambda path: f"{stored[path].name} ({stored[path].size / governor.MB:.1f} MB)"
+        # Options are paths so a new upload does not shift the current selection
+        if multiple:
+            chosen = st.multiselect("Uploaded large files", list(stored), format_func=label, key=key)
+            return [stored[path] for path in chosen]
+        chosen = st.selectbox("Uploaded large file", [None] + list(stored),
+                              format_func=lambda path: "None" if path is None else label(path), key=key)
+        return stored.get(chosen)
 
+ARCHIVE_TYPES = ["zip", "tar", "tgz", "gz", "tbz2", "bz2", "txz", "xz"]
+IMAGE_TYPES = [extension.lstrip(".") for extension in docs.IMAGE_EXTENSIONS]
+# Formats browsers can show as a preview
+PREVIEW_TYPES = (".jpg", ".jpeg", ".png", ".webp")
 
-def merge_pdfs(pdf_files):
-    """Merge multiple PDF files into one"""
-    try:
-        # Create a new PDF document
-        merged_pdf = fitz.open()
-        
-        # Append each PDF
-        for pdf_file in pdf_files:
-            pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-            merged_pdf.insert_pdf(pdf_document)
-            pdf_document.close()
-        
-        # Save to bytes buffer
-        buffer = BytesIO()
-        merged_pdf.save(buffer)
-        buffer.seek(0)
-        merged_pdf.close()
-        
-        return buffer
-        
-    except Exception as e:
-        st.error(f"Error merging PDFs: {str(e)}")
+def input_folder_input(key=None):
+    """Pick a server folder listed in ADC_INPUT_DIRS; returns its path or None"""
+    folders = uploads.list_input_folders()
+    if not folders:
         return None
+    with st.expander("🗂️ Server folders"):
+        return st.selectbox("Use every matching file in a folder", [None] + folders,
+                            format_func=lambda path: "None" if path is None else path, key=key)
 
-def split_pdf(pdf_file, split_type="single", start_page=1, end_page=1):
-    """Split a PDF file into multiple files"""
-    try:
-        # Open the PDF file
-        pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        
-        if split_type == "single":
-            # Create a zip file containing all pages as separate PDFs
-            zip_buffer = BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                for page_num in range(len(pdf_document)):
-                    # Create a new PDF for each page
-                    single_page_pdf = fitz.open()
-                    single_page_pdf.insert_pdf(pdf_document, from_page=page_num, to_page=page_num)
-                    
-                    # Save to bytes buffer
-                    page_buffer = BytesIO()
-                    single_page_pdf.save(page_buffer)
-                    page_buffer.seek(0)
-                    
-                    # Add to zip
-                    zip_file.writestr(f"page_{page_num + 1}.pdf", page_buffer.getvalue())
-                    single_page_pdf.close()
-            
-            pdf_document.close()
-            zip_buffer.seek(0)
-            return zip_buffer
-            
-        else:  # Page range
-            # Create a new PDF with the specified page range
-            extracted_pdf = fitz.open()
-            extracted_pdf.insert_pdf(pdf_document, from_page=start_page-1, to_page=end_page-1)
-            
-            # Save to bytes buffer
-            buffer = BytesIO()
-            extracted_pdf.save(buffer)
-            buffer.seek(0)
-            
-            pdf_document.close()
-            extracted_pdf.close()
-            
-            return buffer
-            
-    except Exception as e:
-        st.error(f"Error splitting PDF: {str(e)}")
-        return None
-    
+def collection_filters_input(sources):
+    """Include/exclude patterns, shown when a folder or archive is among the inputs"""
+    if not any(docs.is_collection(source) for source in sources):
+        return None, None
+    st.caption("Files in folders and archives are used in natural order (scan2 before scan10).")
+    col1, col2 = st.columns(2)
+    with col1:
+        include = st.text_input("Only files matching (optional)", placeholder="e.g. scan*.pdf, 2024/*",
+                                help="Comma-separated patterns matched against file names and paths")
+    with col2:
+        exclude = st.text_input("Skip files matching (optional)", placeholder="e.g. *draft*")
+    return include.strip() or None, exclude.strip() or None
 
+THUMBNAILS_PER_VIEW = 12
 
+def source_key(source):
+    """Identify an upload for caching, without reading it"""
+    if isinstance(source, uploads.StoredFile):
+        return source.path, os.path.getmtime(source.path)
+    return source.file_id, source.size
 
+@st.cache_data(max_entries=100, show_spinner=False)
+def page_thumbnails(key, pages, rotate, _pdf_file):
+    """Thumbnails of a few pages; each view is rendered once per file, in a sandboxed worker"""
+    return governor.run_spooled(docs.render_thumbnails, _pdf_file, pages, rotate=rotate)
 
+@st.cache_data(max_entries=100, show_spinner=False)
+def cached_page_count(key, _pdf_file):
+    return governor.run_spooled(docs.page_count, _pdf_file)
 
-def compress_pdf(pdf_file, compression_level=3):
-    """Compress a PDF file by recompressing images and optimizing storage"""
+def pdf_page_count(pdf_file):
+    """Page count of an upload, read in a sandboxed worker; stops the page on failure"""
     try:
-        # Open the PDF
-        pdf_document = fitz.open(stream=pdf_file.read(), filetype="pdf")
-
-        # Map compression level to image quality
-        quality_map = {
-            1: 95,  # light
-            2: 85,  # medium
-            3: 75,  # balanced
-            4: 65,  # strong
-            5: 50   # max
-        }
-        image_quality = quality_map.get(compression_level, 75)
-
-        # Process each page and its images
-        for page_index in range(len(pdf_document)):
-            page = pdf_document[page_index]
-            images = page.get_images(full=True)
-
-            for img_index, img in enumerate(images):
-                xref = img[0]
-                base_image = pdf_document.extract_image(xref)
-                image_bytes = base_image["image"]
-
-                # Open with Pillow
-                image = Image.open(BytesIO(image_bytes)).convert("RGB")
-
-                # Recompress with selected quality
-                img_buffer = BytesIO()
-                image.save(img_buffer, format="JPEG", quality=image_quality, optimize=True)
-                new_image_bytes = img_buffer.getvalue()
-
-                # Replace old image with new compressed one
-                pdf_document.update_stream(xref, new_image_bytes)
-
-        # Save with cleanup & compression
-        buffer = BytesIO()
-        pdf_document.save(
-            buffer,
-            deflate=True,      # compress streams
-            garbage=4,         # remove unused objects
-            clean=True,        # clean up
-            incremental=False
-        )
-        buffer.seek(0)
-        pdf_document.close()
-
-        return buffer
-
+        return cached_page_count(source_key(pdf_file), pdf_file)
     except Exception as e:
-        st.error(f"Error compressing PDF: {str(e)}")
-        return None  
-st.sidebar.header("Made By Subhadip 😎")
+        st.error(f"Could not read {pdf_file.name}: {str(e)}")
+        st.stop()
+
 def main():
     # Header
     st.markdown('<h1 class="main-header">📄 Advanced Document Converter</h1>', unsafe_allow_html=True)
@@ -519,11 +515,17 @@ def main():
                 "Merge PDFs", 
                 "Split PDF", 
                 "Compress PDF",
+                "Stamp PDF",
+                "Organize Pages",
+                "Compare PDFs",
+                "PDF Pipeline",
                 "PDF to PowerPoint",
                 "PDF to JPG", 
+                "Extract Images",
                 "JPG to PDF",
                 "PDF to Excel",
-                # "Excel to PDF"
+                "PDF to Text",
+                "Excel to PDF"
             ]
         )
         
@@ -555,6 +557,8 @@ def main():
             type=["pdf"],
             help="Select a PDF file to convert to Word format"
         )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["pdf"])
         
         if uploaded_file is not None:
             # Display file info
@@ -565,18 +569,21 @@ def main():
             st.write("**File details:**")
             st.json(file_details)
             
+            pages = page_selection_input()
+            backend = backend_input("pdf_to_word")
+            
             # Convert button
             if st.button("Convert PDF to Word"):
                 with st.spinner("Converting PDF to Word..."):
                     # Convert PDF to Word
-                    word_data = pdf_to_word(uploaded_file)
+                    word_data = pdf_to_word(uploaded_file, pages, backend)
                     
                     if word_data:
                         st.markdown('<div class="success-box">✅ Conversion completed successfully!</div>', unsafe_allow_html=True)
                         
                         # Download button
                         output_filename = Path(uploaded_file.name).stem + ".docx"
-                        st.download_button(
+                        download_result(
                             label="📥 Download Word Document",
                             data=word_data,
                             file_name=output_filename,
@@ -593,6 +600,8 @@ def main():
             type=["docx", "doc"],
             help="Select a Word file to convert to PDF format"
         )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["docx", "doc"])
         
         if uploaded_file is not None:
             # Display file info
@@ -603,18 +612,20 @@ def main():
             st.write("**File details:**")
             st.json(file_details)
             
+            backend = backend_input("word_to_pdf")
+            
             # Convert button
             if st.button("Convert Word to PDF"):
                 with st.spinner("Converting Word to PDF..."):
                     # Convert Word to PDF
-                    pdf_data = word_to_pdf(uploaded_file)
+                    pdf_data = word_to_pdf(uploaded_file, backend)
                     
                     if pdf_data:
                         st.markdown('<div class="success-box">✅ Conversion completed successfully!</div>', unsafe_allow_html=True)
                         
                         # Download button
                         output_filename = Path(uploaded_file.name).stem + ".pdf"
-                        st.download_button(
+                        download_result(
                             label="📥 Download PDF Document",
                             data=pdf_data,
                             file_name=output_filename,
@@ -629,27 +640,35 @@ def main():
         st.markdown('<div class="converter-option">', unsafe_allow_html=True)
         
         uploaded_files = st.file_uploader(
-            "Choose PDF files to merge",
-            type=["pdf"],
-            help="Select multiple PDF files to merge",
+            "Choose PDF files (or ZIP/TAR archives of PDFs) to merge",
+            type=["pdf"] + ARCHIVE_TYPES,
+            help="Select multiple PDF files to merge, or an archive holding them",
             accept_multiple_files=True
         )
+        uploaded_files += large_file_input(["pdf"] + ARCHIVE_TYPES, multiple=True)
+        folder = input_folder_input(key="merge_folder")
+        if folder:
+            uploaded_files.append(folder)
         
-        if uploaded_files and len(uploaded_files) > 1:
+        if uploaded_files and (len(uploaded_files) > 1 or docs.is_collection(uploaded_files[0])):
             st.write(f"**Files to merge:** {len(uploaded_files)} files selected")
+            include, exclude = collection_filters_input(uploaded_files)
+            
+            output = output_options_input()
             
             # Convert button
             if st.button("Merge PDFs"):
                 with st.spinner("Merging PDF files..."):
                     # Merge PDFs
-                    merged_pdf = merge_pdfs(uploaded_files)
+                    merged_pdf = merge_pdfs(uploaded_files, output, include, exclude)
                     
                     if merged_pdf:
                         st.markdown('<div class="success-box">✅ PDFs merged successfully!</div>', unsafe_allow_html=True)
+                        show_output_report(merged_pdf)
                         
                         # Download button
                         output_filename = "merged_document.pdf"
-                        st.download_button(
+                        download_result(
                             label="📥 Download Merged PDF",
                             data=merged_pdf,
                             file_name=output_filename,
@@ -668,6 +687,8 @@ def main():
             type=["pdf"],
             help="Select a PDF file to split into multiple files"
         )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["pdf"])
         
         if uploaded_file is not None:
             # Display file info
@@ -679,37 +700,60 @@ def main():
             st.json(file_details)
             
             # Get page range
-            pdf_document = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-            page_count = len(pdf_document)
-            pdf_document.close()
-            uploaded_file.seek(0)
+            page_count = pdf_page_count(uploaded_file)
             
             st.write(f"**Total pages:** {page_count}")
             
             split_option = st.radio(
                 "Split by:",
-                ["Single page", "Page range"]
+                ["Single page", "Page range", "Page selection"]
             )
             
+            output = output_options_input()
+            
             if split_option == "Single page":
+                pages = page_selection_input()
+                
                 # Convert button for single page split
                 if st.button("Split PDF into Single Pages"):
                     with st.spinner("Splitting PDF into single pages..."):
                         # Split PDF
-                        zip_data = split_pdf(uploaded_file, "single")
+                        zip_data = split_pdf(uploaded_file, "single", pages=pages, output=output)
                         
                         if zip_data:
                             st.markdown('<div class="success-box">✅ PDF split successfully!</div>', unsafe_allow_html=True)
                             
                             # Download button
                             output_filename = "split_pages.zip"
-                            st.download_button(
+                            download_result(
                                 label="📥 Download Split Pages (ZIP)",
                                 data=zip_data,
                                 file_name=output_filename,
                                 mime="application/zip"
                             )
             
+            elif split_option == "Page selection":
+                pages = st.text_input("Pages to extract", placeholder="e.g. 1-5,8,10-")
+                
+                # Convert button for page selection split
+                if pages.strip() and st.button("Extract Selected Pages"):
+                    with st.spinner("Extracting selected pages..."):
+                        # Split PDF
+                        pdf_data = split_pdf(uploaded_file, "selection", pages=pages, output=output)
+                        
+                        if pdf_data:
+                            st.markdown('<div class="success-box">✅ PDF split successfully!</div>', unsafe_allow_html=True)
+                            show_output_report(pdf_data)
+                            
+                            # Download button
+                            output_filename = f"{Path(uploaded_file.name).stem}_selected_pages.pdf"
+                            download_result(
+                                label="📥 Download PDF Extract",
+                                data=pdf_data,
+                                file_name=output_filename,
+                                mime="application/pdf"
+                            )
+            
             else:  # Page range
                 col1, col2 = st.columns(2)
                 with col1:
@@ -724,14 +768,15 @@ def main():
                     if st.button("Split PDF by Page Range"):
                         with st.spinner("Splitting PDF by page range..."):
                             # Split PDF
-                            pdf_data = split_pdf(uploaded_file, "range", start_page, end_page)
+                            pdf_data = split_pdf(uploaded_file, "range", start_page, end_page, output=output)
                             
                             if pdf_data:
                                 st.markdown('<div class="success-box">✅ PDF split successfully!</div>', unsafe_allow_html=True)
+                                show_output_report(pdf_data)
                                 
                                 # Download button
                                 output_filename = f"pages_{start_page}_to_{end_page}.pdf"
-                                st.download_button(
+                                download_result(
                                     label="📥 Download PDF Extract",
                                     data=pdf_data,
                                     file_name=output_filename,
@@ -748,6 +793,8 @@ def main():
             type=["pdf"],
             help="Select a PDF file to reduce its file size"
         )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["pdf"])
         
         if uploaded_file is not None:
             # Display file info
@@ -767,22 +814,26 @@ def main():
                 help="Higher values mean more compression but potentially lower quality"
             )
             
+            pages = page_selection_input()
+            output = output_options_input()
+            
             # Convert button
             if st.button("Compress PDF"):
                 with st.spinner("Compressing PDF..."):
                     # Compress PDF
-                    compressed_pdf = compress_pdf(uploaded_file, compression_level)
+                    compressed_pdf = compress_pdf(uploaded_file, compression_level, pages, output)
                     
                     if compressed_pdf:
                         original_size = uploaded_file.size / 1024
-                        new_size = len(compressed_pdf.getvalue()) / 1024
+                        new_size = compressed_pdf.size / 1024
                         reduction = ((original_size - new_size) / original_size) * 100
                         
                         st.markdown(f'<div class="success-box">✅ PDF compressed successfully! Size reduced from {original_size:.2f} KB to {new_size:.2f} KB ({reduction:.1f}% reduction)</div>', unsafe_allow_html=True)
+                        show_output_report(compressed_pdf)
                         
                         # Download button
                         output_filename = "compressed_" + uploaded_file.name
-                        st.download_button(
+                        download_result(
                             label="📥 Download Compressed PDF",
                             data=compressed_pdf,
                             file_name=output_filename,
@@ -790,6 +841,250 @@ def main():
                         )
         st.markdown('</div>', unsafe_allow_html=True)
     
+    elif tool_option == "Stamp PDF":
+        st.markdown('<h2 class="sub-header">Watermark, Stamp and Number Pages</h2>', unsafe_allow_html=True)
+        st.markdown('<div class="converter-option">', unsafe_allow_html=True)
+        
+        uploaded_file = st.file_uploader(
+            "Choose a PDF file to stamp",
+            type=["pdf"],
+            help="Add a watermark, a stamp, page numbers or Bates numbers to every page"
+        )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["pdf"])
+        
+        if uploaded_file is not None:
+            options = stamp_options_input()
+            pages = page_selection_input()
+            
+            if not options.get("text") and not options.get("number_format"):
+                st.warning("Enter a watermark text or choose a numbering.")
+            elif st.button("Stamp PDF"):
+                with st.spinner("Stamping PDF..."):
+                    stamped_pdf = stamp_pdf(uploaded_file, pages, **options)
+                    
+                    if stamped_pdf:
+                        st.markdown('<div class="success-box">✅ PDF stamped successfully!</div>', unsafe_allow_html=True)
+                        
+                        # Download button
+                        download_result(
+                            label="📥 Download Stamped PDF",
+                            data=stamped_pdf,
+                            file_name="stamped_" + uploaded_file.name,
+                            mime="application/pdf"
+                        )
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    elif tool_option == "Organize Pages":
+        st.markdown('<h2 class="sub-header">Organize PDF Pages</h2>', unsafe_allow_html=True)
+        st.markdown('<div class="converter-option">', unsafe_allow_html=True)
+        
+        uploaded_file = st.file_uploader(
+            "Choose a PDF file to organize",
+            type=["pdf"],
+            help="Reorder, rotate, delete or extract pages without re-encoding them"
+        )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["pdf"])
+        
+        if uploaded_file is not None:
+            page_count = pdf_page_count(uploaded_file)
+            
+            st.write(f"**Total pages:** {page_count}")
+            
+            order = st.text_input(
+                "Page order (optional)",
+                placeholder="e.g. 3,1-2,10-5",
+                help="The new order of the pages; ranges may run backwards. Pages left out are removed, "
+                     "so this also extracts pages. Leave empty to keep the current order."
+            )
+            rotate = st.text_input(
+                "Rotate pages (optional)",
+                placeholder="e.g. 1-3:90,7:180",
+                help="Pages and the clockwise rotation to add, in degrees"
+            )
+            delete = st.text_input("Delete pages (optional)", placeholder="e.g. 2,5-6")
+            output = output_options_input()
+            
+            try:
+                new_order, rotations = docs.plan_organization(page_count, order, rotate, delete)
+            except ValueError as e:
+                st.warning(str(e))
+                new_order = None
+            
+            if new_order:
+                st.write(f"**Result:** {len(new_order)} pages")
+                
+                # Only the pages in view are rendered
+                view_count = (len(new_order) + THUMBNAILS_PER_VIEW - 1) // THUMBNAILS_PER_VIEW
+                view = 1
+                if view_count > 1:
+                    view = st.number_input("Preview", min_value=1, max_value=view_count, value=1,
+                                           help=f"{THUMBNAILS_PER_VIEW} pages per view")
+                first = (view - 1) * THUMBNAILS_PER_VIEW
+                shown = tuple(new_order[first:first + THUMBNAILS_PER_VIEW])
+                try:
+                    thumbnails = page_thumbnails(source_key(uploaded_file), shown,
+                                                 {index: rotations[index] for index in shown if index in rotations},
+                                                 uploaded_file)
+                except Exception as e:
+                    st.warning(f"Could not render the previews: {str(e)}")
+                    thumbnails = []
+                cols = st.columns(6)
+                for position, (index, thumbnail) in enumerate(zip(shown, thumbnails)):
+                    with cols[position % 6]:
+                        st.image(thumbnail, caption=f"{first + position + 1} (was {index + 1})")
+                
+                # Convert button
+                if st.button("Organize PDF"):
+                    with st.spinner("Organizing pages..."):
+                        organized_pdf = organize_pages(uploaded_file, order, rotate, delete, output)
+                        
+                        if organized_pdf:
+                            st.markdown('<div class="success-box">✅ Pages organized successfully!</div>', unsafe_allow_html=True)
+                            show_output_report(organized_pdf)
+                            
+                            # Download button
+                            download_result(
+                                label="📥 Download Organized PDF",
+                                data=organized_pdf,
+                                file_name="organized_" + uploaded_file.name,
+                                mime="application/pdf"
+                            )
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    elif tool_option == "Compare PDFs":
+        st.markdown('<h2 class="sub-header">Compare Two PDF Revisions</h2>', unsafe_allow_html=True)
+        st.markdown('<div class="converter-option">', unsafe_allow_html=True)
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            old_file = st.file_uploader("Old revision", type=["pdf"], help="The earlier version of the document")
+            if old_file is None:
+                old_file = large_file_input(["pdf"], key="compare_old")
+        with col2:
+            new_file = st.file_uploader("New revision", type=["pdf"], help="The later version of the document")
+            if new_file is None:
+                new_file = large_file_input(["pdf"], key="compare_new")
+        
+        if old_file is not None and new_file is not None:
+            report_option = st.radio("Report", ["Annotated PDF", "HTML report"], horizontal=True,
+                                     help="The annotated PDF is the new revision with the changes marked")
+            pixel_diff = st.checkbox(
+                "Also compare how pages look",
+                help="Renders changed pages at low resolution to find changes that are not text, such as images"
+            )
+            
+            # Convert button
+            if st.button("Compare PDFs"):
+                with st.spinner("Comparing PDFs..."):
+                    report = "pdf" if report_option == "Annotated PDF" else "html"
+                    comparison = compare_pdfs(old_file, new_file, report, pixel_diff)
+                    
+                    if comparison:
+                        st.markdown('<div class="success-box">✅ Comparison complete!</div>', unsafe_allow_html=True)
+                        
+                        # Download button
+                        if report == "html":
+                            with open(comparison, encoding="utf-8") as f:
+                                components.html(f.read(), height=600, scrolling=True)
+                            download_result(
+                                label="📥 Download Report",
+                                data=comparison,
+                                file_name="comparison.html",
+                                mime="text/html"
+                            )
+                        else:
+                            download_result(
+                                label="📥 Download Annotated PDF",
+                                data=comparison,
+                                file_name="compared_" + new_file.name,
+                                mime="application/pdf"
+                            )
+        st.markdown('</div>', unsafe_allow_html=True)
+    
+    elif tool_option == "PDF Pipeline":
+        st.markdown('<h2 class="sub-header">PDF Pipeline</h2>', unsafe_allow_html=True)
+        st.markdown('<div class="converter-option">', unsafe_allow_html=True)
+        
+        uploaded_files = st.file_uploader(
+            "Choose PDF file(s)",
+            type=["pdf"],
+            help="Select one or more PDF files to run through several operations in one go",
+            accept_multiple_files=True
+        )
+        uploaded_files += large_file_input(["pdf"], multiple=True)
+        
+        if uploaded_files:
+            st.write(f"**Input files:** {len(uploaded_files)} files selected")
+            
+            # Steps run in the order they are picked
+            step_names = st.multiselect(
+                "Steps (applied in the order selected)",
+                ["Merge", "Extract pages", "Organize pages", "Compress", "Stamp", "Split into single pages"],
+                default=["Merge"] if len(uploaded_files) > 1 else [],
+                help="The document stays in memory between steps and is only saved once at the end"
+            )
+            
+            steps = []
+            for step_name in step_names:
+                if step_name == "Merge":
+                    steps.append({"op": "merge"})
+                elif step_name == "Extract pages":
+                    pages = st.text_input("Pages to keep", value="1-", help="A page selection such as 1-5,8,10-")
+                    steps.append({"op": "extract", "pages": pages})
+                elif step_name == "Organize pages":
+                    order = st.text_input("Page order (optional)", placeholder="e.g. 3,1-2,10-5", key="pipeline_order",
+                                          help="The new order of the pages; pages left out are removed")
+                    rotate = st.text_input("Rotate pages (optional)", placeholder="e.g. 1-3:90,7:180",
+                                           key="pipeline_rotate")
+                    delete = st.text_input("Delete pages (optional)", placeholder="e.g. 2,5-6", key="pipeline_delete")
+                    steps.append({"op": "organize", "order": order or None, "rotate": rotate or None,
+                                  "delete": delete or None})
+                elif step_name == "Compress":
+                    compression_level = st.slider("Compression level", min_value=1, max_value=5, value=3)
+                    steps.append({"op": "compress", "level": compression_level})
+                elif step_name == "Stamp":
+                    steps.append({"op": "stamp", **stamp_options_input(key="pipeline_stamp")})
+                else:
+                    steps.append({"op": "split"})
+            
+            if len(uploaded_files) > 1 and "Merge" not in step_names:
+                st.warning("Add a Merge step to combine multiple files.")
+            elif "Split into single pages" in step_names[:-1]:
+                st.warning("Splitting into single pages must be the last step.")
+            elif steps:
+                output = output_options_input()
+                
+                st.write("**Recipe:**")
+                st.json(steps)
+                
+                # Convert button
+                if st.button("Run Pipeline"):
+                    with st.spinner("Running pipeline..."):
+                        result = run_pdf_pipeline(uploaded_files, steps, output)
+                        
+                        if result:
+                            st.markdown('<div class="success-box">✅ Pipeline completed successfully!</div>', unsafe_allow_html=True)
+                            
+                            # Download button
+                            if docs.pipeline_output_type(steps) == "zip":
+                                download_result(
+                                    label="📥 Download Pages (ZIP)",
+                                    data=result,
+                                    file_name="pipeline_pages.zip",
+                                    mime="application/zip"
+                                )
+                            else:
+                                show_output_report(result)
+                                download_result(
+                                    label="📥 Download PDF",
+                                    data=result,
+                                    file_name="pipeline_result.pdf",
+                                    mime="application/pdf"
+                                )
+        st.markdown('</div>', unsafe_allow_html=True)
+    
     elif tool_option == "PDF to PowerPoint":
         st.markdown('<h2 class="sub-header">PDF to PowerPoint Converter</h2>', unsafe_allow_html=True)
         st.markdown('<div class="converter-option">', unsafe_allow_html=True)
@@ -799,6 +1094,8 @@ def main():
             type=["pdf"],
             help="Select a PDF file to convert to PowerPoint format"
         )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["pdf"])
         
         if uploaded_file is not None:
             # Display file info
@@ -809,18 +1106,20 @@ def main():
             st.write("**File details:**")
             st.json(file_details)
             
+            pages = page_selection_input()
+            
             # Convert button
             if st.button("Convert PDF to PowerPoint"):
                 with st.spinner("Converting PDF to PowerPoint..."):
                     # Convert PDF to PowerPoint
-                    pptx_data = pdf_to_pptx(uploaded_file)
+                    pptx_data = pdf_to_pptx(uploaded_file, pages)
                     
                     if pptx_data:
                         st.markdown('<div class="success-box">✅ Conversion completed successfully!</div>', unsafe_allow_html=True)
                         
                         # Download button
                         output_filename = Path(uploaded_file.name).stem + ".pptx"
-                        st.download_button(
+                        download_result(
                             label="📥 Download PowerPoint Presentation",
                             data=pptx_data,
                             file_name=output_filename,
@@ -837,6 +1136,8 @@ def main():
             type=["pdf"],
             help="Select a PDF file to convert to JPG image"
         )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["pdf"])
         
         if uploaded_file is not None:
             # Display file info
@@ -848,14 +1149,36 @@ def main():
             st.json(file_details)
             
             # Get page count
-            pdf_document = fitz.open(stream=uploaded_file.read(), filetype="pdf")
-            page_count = len(pdf_document)
-            pdf_document.close()
-            uploaded_file.seek(0)
+            page_count = pdf_page_count(uploaded_file)
             
             st.write(f"**Total pages:** {page_count}")
             
+            jpg_option = "Single page"
             if page_count > 1:
+                jpg_option = st.radio("Convert:", ["Single page", "Page selection"])
+            
+            if jpg_option == "Page selection":
+                pages = st.text_input("Pages to convert", placeholder="e.g. 1-5,8,10-")
+                
+                # Convert button for several pages
+                if pages.strip() and st.button("Convert Pages to JPG"):
+                    with st.spinner("Converting PDF pages to JPG..."):
+                        # Convert PDF pages to JPG
+                        zip_data = pdf_pages_to_jpg(uploaded_file, pages)
+                        
+                        if zip_data:
+                            st.markdown('<div class="success-box">✅ Conversion completed successfully!</div>', unsafe_allow_html=True)
+                            
+                            # Download button
+                            output_filename = f"{Path(uploaded_file.name).stem}_pages.zip"
+                            download_result(
+                                label="📥 Download JPG Images (ZIP)",
+                                data=zip_data,
+                                file_name=output_filename,
+                                mime="application/zip"
+                            )
+            
+            elif page_count > 1:
                 page_number = st.number_input(
                     "Page to convert to JPG",
                     min_value=1,
@@ -867,7 +1190,7 @@ def main():
                 page_number = 1
             
             # Convert button
-            if st.button("Convert PDF to JPG"):
+            if jpg_option == "Single page" and st.button("Convert PDF to JPG"):
                 with st.spinner("Converting PDF to JPG..."):
                     # Convert PDF to JPG
                     jpg_data = pdf_to_jpg(uploaded_file, page_number-1)
@@ -876,11 +1199,11 @@ def main():
                         st.markdown('<div class="success-box">✅ Conversion completed successfully!</div>', unsafe_allow_html=True)
                         
                         # Display image
-                        st.image(jpg_data, caption=f"Page {page_number}", use_column_width=True)
+                        st.image(os.fspath(jpg_data), caption=f"Page {page_number}", use_column_width=True)
                         
                         # Download button
                         output_filename = f"{Path(uploaded_file.name).stem}_page{page_number}.jpg"
-                        st.download_button(
+                        download_result(
                             label="📥 Download JPG Image",
                             data=jpg_data,
                             file_name=output_filename,
@@ -888,39 +1211,104 @@ def main():
                         )
         st.markdown('</div>', unsafe_allow_html=True)
     
+    elif tool_option == "Extract Images":
+        st.markdown('<h2 class="sub-header">Extract Images from PDF</h2>', unsafe_allow_html=True)
+        st.markdown('<div class="converter-option">', unsafe_allow_html=True)
+        
+        uploaded_file = st.file_uploader(
+            "Choose a PDF file",
+            type=["pdf"],
+            help="Select a PDF file to extract its embedded images"
+        )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["pdf"])
+        
+        if uploaded_file is not None:
+            # Display file info
+            file_details = {
+                "Filename": uploaded_file.name,
+                "File size": f"{uploaded_file.size / 1024:.2f} KB"
+            }
+            st.write("**File details:**")
+            st.json(file_details)
+            
+            st.info("Images are saved exactly as they are stored in the PDF (JPEG, JPEG 2000 or PNG), without re-rendering the pages.")
+            
+            pages = page_selection_input()
+            
+            # Minimum size filters
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                min_width = st.number_input("Min width (px)", min_value=0, value=0)
+            with col2:
+                min_height = st.number_input("Min height (px)", min_value=0, value=0)
+            with col3:
+                min_kb = st.number_input("Min size (KB)", min_value=0, value=0)
+            
+            # Convert button
+            if st.button("Extract Images"):
+                with st.spinner("Extracting images..."):
+                    # Extract images
+                    zip_data = extract_images(uploaded_file, pages, min_width, min_height, min_kb * 1024)
+                    
+                    if zip_data:
+                        st.markdown('<div class="success-box">✅ Images extracted successfully!</div>', unsafe_allow_html=True)
+                        
+                        # Download button
+                        output_filename = f"{Path(uploaded_file.name).stem}_images.zip"
+                        download_result(
+                            label="📥 Download Images (ZIP)",
+                            data=zip_data,
+                            file_name=output_filename,
+                            mime="application/zip"
+                        )
+        st.markdown('</div>', unsafe_allow_html=True)
+    
     elif tool_option == "JPG to PDF":
         st.markdown('<h2 class="sub-header">JPG to PDF Converter</h2>', unsafe_allow_html=True)
         st.markdown('<div class="converter-option">', unsafe_allow_html=True)
         
         uploaded_files = st.file_uploader(
-            "Choose JPG images to convert to PDF",
-            type=["jpg", "jpeg", "png"],
-            help="Select one or more image files to convert to PDF",
+            "Choose images (or ZIP/TAR archives of images) to convert to PDF",
+            type=IMAGE_TYPES + ARCHIVE_TYPES,
+            help=("JPEG, PNG, TIFF (every page)"
+                  + (", WebP or HEIC" if docs.register_heif_opener else " or WebP")
+                  + " images, or an archive holding them. Photos are turned upright from their EXIF orientation."),
             accept_multiple_files=True
         )
+        uploaded_files += large_file_input(IMAGE_TYPES + ARCHIVE_TYPES, multiple=True)
+        folder = input_folder_input(key="jpg_folder")
+        if folder:
+            uploaded_files.append(folder)
         
         if uploaded_files:
             st.write(f"**Files to convert:** {len(uploaded_files)} images selected")
+            include, exclude = collection_filters_input(uploaded_files)
             
             # Display image previews
             if len(uploaded_files) <= 5:  # Only show preview for small number of files
                 cols = st.columns(min(3, len(uploaded_files)))
                 for i, img_file in enumerate(uploaded_files):
                     with cols[i % 3]:
-                        st.image(img_file, caption=img_file.name, use_column_width=True)
+                        if docs.is_collection(img_file):
+                            st.write(f"🗂️ {docs.source_name(img_file)}")
+                        elif isinstance(img_file, uploads.StoredFile) or not img_file.name.lower().endswith(PREVIEW_TYPES):
+                            st.write(f"📦 {img_file.name}")  # large files and TIFF/HEIC are not previewed
+                        else:
+                            st.image(img_file, caption=img_file.name, use_column_width=True)
             
             # Convert button
             if st.button("Convert JPG to PDF"):
                 with st.spinner("Converting images to PDF..."):
                     # Convert JPG to PDF
-                    pdf_data = jpg_to_pdf(uploaded_files)
+                    pdf_data = jpg_to_pdf(uploaded_files, include, exclude)
                     
                     if pdf_data:
                         st.markdown('<div class="success-box">✅ Conversion completed successfully!</div>', unsafe_allow_html=True)
                         
                         # Download button
                         output_filename = "converted_document.pdf"
-                        st.download_button(
+                        download_result(
                             label="📥 Download PDF Document",
                             data=pdf_data,
                             file_name=output_filename,
@@ -937,6 +1325,8 @@ def main():
             type=["pdf"],
             help="Select a PDF file to convert to Excel format"
         )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["pdf"])
         
         if uploaded_file is not None:
             # Display file info
@@ -947,18 +1337,20 @@ def main():
             st.write("**File details:**")
             st.json(file_details)
             
+            pages = page_selection_input()
+            
             # Convert button
             if st.button("Convert PDF to Excel"):
                 with st.spinner("Converting PDF to Excel..."):
                     # Convert PDF to Excel
-                    excel_data = pdf_to_excel(uploaded_file)
+                    excel_data = pdf_to_excel(uploaded_file, pages)
                     
                     if excel_data:
                         st.markdown('<div class="success-box">✅ Conversion completed successfully!</div>', unsafe_allow_html=True)
                         
                         # Download button
                         output_filename = Path(uploaded_file.name).stem + ".xlsx"
-                        st.download_button(
+                        download_result(
                             label="📥 Download Excel Spreadsheet",
                             data=excel_data,
                             file_name=output_filename,
@@ -966,6 +1358,57 @@ def main():
                         )
         st.markdown('</div>', unsafe_allow_html=True)
     
+    elif tool_option == "PDF to Text":
+        st.markdown('<h2 class="sub-header">PDF to Text Exporter</h2>', unsafe_allow_html=True)
+        st.markdown('<div class="converter-option">', unsafe_allow_html=True)
+        
+        uploaded_file = st.file_uploader(
+            "Choose a PDF file",
+            type=["pdf"],
+            help="Select a PDF file to export as text"
+        )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["pdf"])
+        
+        if uploaded_file is not None:
+            # Display file info
+            file_details = {
+                "Filename": uploaded_file.name,
+                "File size": f"{uploaded_file.size / 1024:.2f} KB"
+            }
+            st.write("**File details:**")
+            st.json(file_details)
+            
+            text_format = st.radio(
+                "Format:",
+                ["markdown", "jsonl", "text"],
+                format_func={
+                    "markdown": "Markdown (headings, bold, lists)",
+                    "jsonl": "JSON Lines (one page per line, with block coordinates)",
+                    "text": "Plain text (pages separated by form feeds)",
+                }.get,
+                help="JSON Lines suits search indexers: each line is one page with its text blocks and their positions"
+            )
+            pages = page_selection_input()
+            
+            # Convert button
+            if st.button("Export Text"):
+                with st.spinner("Exporting text..."):
+                    text_data = pdf_to_text(uploaded_file, text_format, pages)
+                    
+                    if text_data:
+                        st.markdown('<div class="success-box">✅ Export completed successfully!</div>', unsafe_allow_html=True)
+                        
+                        # Download button
+                        extension, mime = docs.TEXT_FORMATS[text_format]
+                        download_result(
+                            label="📥 Download Text",
+                            data=text_data,
+                            file_name=Path(uploaded_file.name).stem + extension,
+                            mime=mime
+                        )
+        st.markdown('</div>', unsafe_allow_html=True)
+    
     elif tool_option == "Excel to PDF":
         st.markdown('<h2 class="sub-header">Excel to PDF Converter</h2>', unsafe_allow_html=True)
         st.markdown('<div class="converter-option">', unsafe_allow_html=True)
@@ -975,6 +1418,8 @@ def main():
             type=["xlsx", "xls"],
             help="Select an Excel file to convert to PDF format"
         )
+        if uploaded_file is None:
+            uploaded_file = large_file_input(["xlsx", "xls"])
         
         if uploaded_file is not None:
             # Display file info
@@ -985,18 +1430,20 @@ def main():
             st.write("**File details:**")
             st.json(file_details)
             
+            backend = backend_input("excel_to_pdf")
+            
             # Convert button
             if st.button("Convert Excel to PDF"):
                 with st.spinner("Converting Excel to PDF..."):
                     # Convert Excel to PDF
-                    pdf_data = excel_to_pdf(uploaded_file)
+                    pdf_data = excel_to_pdf(uploaded_file, backend)
                     
                     if pdf_data:
                         st.markdown('<div class="success-box">✅ Conversion completed successfully!</div>', unsafe_allow_html=True)
                         
                         # Download button
                         output_filename = Path(uploaded_file.name).stem + ".pdf"
-                        st.download_button(
+                        download_result(
                             label="📥 Download PDF Document",
                             data=pdf_data,
                             file_name=output_filename,
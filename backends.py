@@ -0,0 +1,370 @@
+"""Pluggable conversion backends.
+
+Some conversions can be done by several engines:
+
+- ``libreoffice``: a headless LibreOffice subprocess
+- ``aspose``: Aspose.Words / Aspose.Cells / Aspose.PDF, in-process. Only
+  offered when ``ADC_ASPOSE_LICENSE`` names a license file, as evaluation
+  mode watermarks and truncates documents
+- ``msword``: Microsoft Word through COM automation (Windows only)
+- ``pymupdf``: the PyMuPDF text extraction in docs.py
+- ``python``: pure-Python fallbacks (python-docx / pandas + ReportLab) that
+  keep the text but lose most of the layout
+
+``BACKENDS`` lists the engines for each conversion in order of preference.
+``choose_backend`` picks the fastest installed non-fallback engine using the
+numbers recorded by ``run_benchmark`` (``python cli.py benchmark``). Without
+benchmark data, it uses the first installed engine. Fallbacks are only used
+when nothing else is installed. Set ``ADC_BACKEND_<CONVERSION>`` (e.g.
+``ADC_BACKEND_WORD_TO_PDF=libreoffice``) to force an engine.
+"""
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from functools import lru_cache
+from io import BytesIO
+from pathlib import Path
+
+import docs
+
+BENCHMARK_FILE = os.environ.get("ADC_BENCHMARK_FILE", os.path.join("output", "benchmarks.json"))
+LIBREOFFICE_TIMEOUT = 300
+ASPOSE_LICENSE = os.environ.get("ADC_ASPOSE_LICENSE")
+
+
+@lru_cache(maxsize=None)
+def _has_module(name):
+    """Whether a module can be imported, without importing it"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+@lru_cache(maxsize=None)
+def _libreoffice_command():
+    """Name of the LibreOffice executable on this system, or None"""
+    candidates = ["soffice"] if sys.platform == "win32" else ["libreoffice", "soffice"]
+    for candidate in candidates:
+        if shutil.which(candidate):
+            return candidate
+    return None
+
+
+def _aspose_available(module):
+    """Whether an Aspose module is installed and a license is configured for it"""
+    return bool(ASPOSE_LICENSE) and os.path.isfile(ASPOSE_LICENSE) and _has_module(module)
+
+
+@lru_cache(maxsize=None)
+def _apply_aspose_license(module):
+    """Apply ADC_ASPOSE_LICENSE to an imported Aspose module, once per process"""
+    module.License().set_license(ASPOSE_LICENSE)
+
+
+def _scratch_dir():
+    """A temporary directory in docs.WORK_DIR, which is the job's own directory in a sandboxed worker"""
+    os.makedirs(docs.WORK_DIR, exist_ok=True)
+    return tempfile.TemporaryDirectory(dir=docs.WORK_DIR)
+
+
+def _source_on_disk(source, tmpdir, default_name):
+    """Return a path to the source, writing it into tmpdir if it is not a file already"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    path = os.path.join(tmpdir, Path(docs.source_name(source, default_name)).name)
+    with open(path, "wb") as f:
+        f.write(docs.read_source(source))
+    return path
+
+
+def _read_output(path):
+    """Read a generated file into a BytesIO"""
+    with open(path, "rb") as f:
+        return BytesIO(f.read())
+
+
+# LibreOffice
+
+def _libreoffice_to_pdf(source, export_filter="pdf", default_name="document"):
+    """Convert an office document to PDF with headless LibreOffice"""
+    with _scratch_dir() as tmpdir:
+        input_path = _source_on_disk(source, tmpdir, default_name)
+        pdf_path = os.path.join(tmpdir, Path(input_path).stem + ".pdf")
+
+        # Arguments are passed as a list so uploaded file names never reach a shell
+        cmd = [_libreoffice_command() or "libreoffice", "--headless", "--convert-to", export_filter,
+               input_path, "--outdir", tmpdir]
+        subprocess.run(cmd, check=True, capture_output=True, timeout=docs.time_left(LIBREOFFICE_TIMEOUT))
+
+        return _read_output(pdf_path)
+
+
+def _libreoffice_word_to_pdf(source):
+    return _libreoffice_to_pdf(source, "pdf", "document.docx")
+
+
+def _libreoffice_excel_to_pdf(source):
+    return _libreoffice_to_pdf(source, "pdf:calc_pdf_Export", "workbook.xlsx")
+
+
+# Aspose (in-process)
+
+def _aspose_word_to_pdf(source):
+    import aspose.words as aw
+
+    _apply_aspose_license(aw)
+    with _scratch_dir() as tmpdir:
+        input_path = _source_on_disk(source, tmpdir, "document.docx")
+        pdf_path = os.path.join(tmpdir, "output.pdf")
+        aw.Document(input_path).save(pdf_path, aw.SaveFormat.PDF)
+        return _read_output(pdf_path)
+
+
+def _aspose_excel_to_pdf(source):
+    import aspose.cells as ac
+
+    _apply_aspose_license(ac)
+    with _scratch_dir() as tmpdir:
+        input_path = _source_on_disk(source, tmpdir, "workbook.xlsx")
+        pdf_path = os.path.join(tmpdir, "output.pdf")
+        ac.Workbook(input_path).save(pdf_path, ac.SaveFormat.PDF)
+        return _read_output(pdf_path)
+
+
+def _aspose_pdf_to_word(source, pages=None):
+    import aspose.pdf as ap
+
+    _apply_aspose_license(ap)
+    if pages is not None:
+        # Hand Aspose only the selected pages
+        source = docs.split_pdf(source, "selection", pages=pages)
+
+    with _scratch_dir() as tmpdir:
+        input_path = _source_on_disk(source, tmpdir, "document.pdf")
+        docx_path = os.path.join(tmpdir, "output.docx")
+        options = ap.DocSaveOptions()
+        options.format = ap.DocSaveOptions.DocFormat.DOC_X
+        ap.Document(input_path).save(docx_path, options)
+        return _read_output(docx_path)
+
+
+# Microsoft Word (COM automation)
+
+def _msword_word_to_pdf(source):
+    import comtypes.client
+
+    with _scratch_dir() as tmpdir:
+        input_path = os.path.abspath(_source_on_disk(source, tmpdir, "document.docx"))
+        pdf_path = os.path.join(os.path.abspath(tmpdir), "output.pdf")
+        word = comtypes.client.CreateObject("Word.Application")
+        try:
+            word.Visible = False
+            document = word.Documents.Open(input_path, ReadOnly=True)
+            document.SaveAs(pdf_path, FileFormat=17)  # wdFormatPDF
+            document.Close(False)
+        finally:
+            word.Quit()
+        return _read_output(pdf_path)
+
+
+# Pure-Python fallbacks
+
+def _python_word_to_pdf(source):
+    """Render the paragraphs of a .docx with ReportLab (text only)"""
+    from docx import Document
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+    from xml.sax.saxutils import escape
+
+    document = Document(docs.source_file(source))
+    styles = getSampleStyleSheet()
+    story = []
+    for paragraph in document.paragraphs:
+        style_name = paragraph.style.name if paragraph.style is not None else ""
+        style = styles["Heading1"] if style_name.startswith(("Heading", "Title")) else styles["Normal"]
+        if paragraph.text.strip():
+            story.append(Paragraph(escape(paragraph.text), style))
+        else:
+            story.append(Spacer(1, 6))
+
+    buffer = BytesIO()
+    SimpleDocTemplate(buffer, pagesize=letter).build(story or [Spacer(1, 6)])
+    buffer.seek(0)
+    return buffer
+
+
+def _python_excel_to_pdf(source):
+    """Render every sheet of a workbook as a ReportLab table (values only)"""
+    import pandas as pd
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import landscape, letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import PageBreak, Paragraph, SimpleDocTemplate, Table, TableStyle
+    from xml.sax.saxutils import escape
+
+    sheets = pd.read_excel(docs.source_file(source), sheet_name=None, header=None)
+    styles = getSampleStyleSheet()
+    story = []
+    for sheet_name, frame in sheets.items():
+        if story:
+            story.append(PageBreak())
+        story.append(Paragraph(escape(str(sheet_name)), styles["Heading2"]))
+        rows = frame.fillna("").astype(str).values.tolist() or [[""]]
+        table = Table(rows, repeatRows=0)
+        table.setStyle(TableStyle([
+            ("GRID", (0, 0), (-1, -1), 0.25, colors.grey),
+            ("FONTSIZE", (0, 0), (-1, -1), 8),
+        ]))
+        story.append(table)
+
+    buffer = BytesIO()
+    SimpleDocTemplate(buffer, pagesize=landscape(letter)).build(story)
+    buffer.seek(0)
+    return buffer
+
+
+BACKENDS = {
+    "word_to_pdf": {
+        "libreoffice": {"available": lambda: _libreoffice_command() is not None, "convert": _libreoffice_word_to_pdf},
+        "aspose": {"available": lambda: _aspose_available("aspose.words"), "convert": _aspose_word_to_pdf},
+        "msword": {"available": lambda: sys.platform == "win32" and _has_module("comtypes"),
+                   "convert": _msword_word_to_pdf},
+        "python": {"available": lambda: True, "convert": _python_word_to_pdf, "fallback": True},
+    },
+    "excel_to_pdf": {
+        "libreoffice": {"available": lambda: _libreoffice_command() is not None, "convert": _libreoffice_excel_to_pdf},
+        "aspose": {"available": lambda: _aspose_available("aspose.cells"), "convert": _aspose_excel_to_pdf},
+        "python": {"available": lambda: True, "convert": _python_excel_to_pdf, "fallback": True},
+    },
+    "pdf_to_word": {
+        "pymupdf": {"available": lambda: True, "convert": docs.pdf_to_word},
+        "aspose": {"available": lambda: _aspose_available("aspose.pdf"), "convert": _aspose_pdf_to_word},
+    },
+}
+
+# Input file extensions each conversion accepts (used to pick benchmark files)
+INPUT_EXTENSIONS = {
+    "word_to_pdf": (".docx", ".doc"),
+    "excel_to_pdf": (".xlsx", ".xls"),
+    "pdf_to_word": (".pdf",),
+}
+
+
+def available_backends(conversion):
+    """Names of the installed backends for a conversion, in order of preference"""
+    return [name for name, backend in BACKENDS[conversion].items() if backend["available"]()]
+
+
+def load_benchmarks(path=None):
+    """Return recorded benchmark results, or {} if there are none"""
+    try:
+        with open(path or BENCHMARK_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def choose_backend(conversion, benchmark_path=None):
+    """Pick the backend to use for a conversion (see the module docstring)
+
+    benchmark_path reads timings from another results file than BENCHMARK_FILE.
+    """
+    installed = available_backends(conversion)
+    if not installed:
+        raise RuntimeError(f"No backend is installed for {conversion}.")
+
+    forced = os.environ.get(f"ADC_BACKEND_{conversion.upper()}")
+    if forced:
+        if forced not in installed:
+            raise RuntimeError(f"Backend {forced!r} for {conversion} is not installed.")
+        return forced
+
+    candidates = [name for name in installed if not BACKENDS[conversion][name].get("fallback")] or installed
+    measured = load_benchmarks(benchmark_path).get(conversion, {})
+    timed = [name for name in candidates if name in measured and not measured[name].get("failures")]
+    if timed:
+        return min(timed, key=lambda name: measured[name]["median_ms"])
+    return candidates[0]
+
+
+def convert(conversion, source, *args, backend=None, **kwargs):
+    """Run a conversion with the given backend, or the one choose_backend picks"""
+    name = backend or choose_backend(conversion)
+    if name not in BACKENDS[conversion]:
+        raise ValueError(f"Unknown backend {name!r} for {conversion}.")
+    return BACKENDS[conversion][name]["convert"](source, *args, **kwargs)
+
+
+def word_to_pdf(source, backend=None):
+    """Convert Word document to PDF"""
+    return convert("word_to_pdf", source, backend=backend)
+
+
+def excel_to_pdf(source, backend=None):
+    """Convert Excel workbook to PDF"""
+    return convert("excel_to_pdf", source, backend=backend)
+
+
+def pdf_to_word(source, pages=None, backend=None):
+    """Convert PDF file to Word document"""
+    return convert("pdf_to_word", source, pages=pages, backend=backend)
+
+
+def run_benchmark(corpus_dir, conversions=None, backends=None, repeat=1, path=None):
+    """Run every installed backend on the same corpus and record latency and throughput
+
+    Each conversion runs in a sandboxed worker (governor.run_limited), so a
+    crashing engine only fails its own measurement. Results are merged into
+    the benchmark file that choose_backend reads, and returned.
+    """
+    import governor
+
+    results = load_benchmarks(path)
+    for conversion in conversions or list(BACKENDS):
+        files = sorted(
+            p for p in Path(corpus_dir).iterdir()
+            if p.is_file() and p.suffix.lower() in INPUT_EXTENSIONS[conversion]
+        )
+        if not files:
+            continue
+
+        for name in available_backends(conversion):
+            if backends and name not in backends:
+                continue
+            timings = []
+            failures = 0
+            total_bytes = 0
+            for file_path in files:
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    try:
+                        governor.run_limited(convert, conversion, str(file_path), backend=name)
+                    except Exception:
+                        failures += 1
+                        continue
+                    timings.append((time.perf_counter() - start) * 1000)
+                    total_bytes += file_path.stat().st_size
+
+            elapsed = sum(timings) / 1000
+            results.setdefault(conversion, {})[name] = {
+                "files": len(files),
+                "runs": len(timings),
+                "failures": failures,
+                "median_ms": statistics.median(timings) if timings else None,
+                "mean_ms": statistics.mean(timings) if timings else None,
+                "files_per_s": len(timings) / elapsed if elapsed else None,
+                "mb_per_s": total_bytes / 1024 / 1024 / elapsed if elapsed else None,
+            }
+
+    os.makedirs(os.path.dirname(path or BENCHMARK_FILE) or ".", exist_ok=True)
+    with open(path or BENCHMARK_FILE, "w") as f:
+        json.dump(results, f, indent=2)
+    return results
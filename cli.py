@@ -0,0 +1,262 @@
+"""Command-line entry point for the document converter.
+
+Examples:
+
+    python cli.py pipeline a.pdf b.pdf -s merge -s "compress level=4" -s split -o pages.zip
+    python cli.py pipeline report.pdf --recipe recipe.json --profile web -o out.pdf
+    python cli.py pipeline scans.zip -s merge --include "batch1/*" -o scans.pdf
+    python cli.py images-to-pdf photos/ --exclude "*thumb*" -o photos.pdf
+    python cli.py extract-images report.pdf --min-width 100 -o images.zip
+    python cli.py stamp contract.pdf --text DRAFT --numbers "Page {n} of {total}" -o draft.pdf
+    python cli.py stamp exhibit.pdf --numbers "ABC{n:06d}" --start 1001 -o exhibit_bates.pdf
+    python cli.py organize scan.pdf --order 10-1 --rotate 1-3:90 --delete 5 -o fixed.pdf
+    python cli.py compare contract_v1.pdf contract_v2.pdf -o changes.html --pixel-diff
+    python cli.py export-text manual.pdf -f jsonl --jobs 4 -o manual.jsonl
+    python cli.py export-text reports/ -f markdown -o - | less
+    python cli.py benchmark samples/ --repeat 3
+    python cli.py upload scan.pdf http://server:8502/<inbox>/
+
+A recipe file is a JSON list of steps, e.g.
+[{"op": "merge"}, {"op": "compress", "level": 4}, {"op": "split"}].
+"""
+import argparse
+import json
+import sys
+
+import backends
+import docs
+import uploads
+
+
+def write_result(result, path):
+    """Write a converter's result (a BytesIO or a docs.ResultFile) to path"""
+    if isinstance(result, docs.ResultFile):
+        result.move_to(path)
+        return
+    with open(path, "wb") as f:
+        f.write(result.getvalue())
+
+
+def parse_step(text):
+    """Parse a step written as "name key=value ..." into a recipe dict"""
+    name, *options = text.split()
+    step = {"op": name}
+    for option in options:
+        key, sep, value = option.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"Step option {option!r} must look like key=value")
+        step[key] = int(value) if value.lstrip("-").isdigit() else value
+    return step
+
+
+def cmd_pipeline(args):
+    """Run a recipe over the input files and write the result"""
+    if args.recipe:
+        with open(args.recipe) as f:
+            steps = json.load(f)
+    else:
+        steps = args.step or []
+    if not steps:
+        sys.exit("No steps given: use --step or --recipe.")
+
+    output = {"profile": args.profile, "strip_metadata": args.strip_metadata}
+    result = docs.run_pipeline(args.inputs, steps, output, args.include, args.exclude)
+    with open(args.output, "wb") as f:
+        f.write(result.getvalue())
+    print(f"Wrote {args.output} ({docs.pipeline_output_type(steps).upper()})")
+
+    if docs.pipeline_output_type(steps) == "pdf":
+        report = docs.describe_output(result.getvalue())
+        print(f"  size: {report['size'] / 1024:.1f} KB, linearized: {'yes' if report['linearized'] else 'no'}")
+        print(f"  first page after {report['first_page_bytes'] / 1024:.1f} KB, rendered in {report['first_page_ms']:.1f} ms")
+
+
+def cmd_images_to_pdf(args):
+    """Put images (files, folders or archives of images) into one PDF"""
+    result = docs.jpg_to_pdf(args.inputs, include=args.include, exclude=args.exclude)
+    with open(args.output, "wb") as f:
+        f.write(result.getvalue())
+    print(f"Wrote {args.output}")
+
+
+def cmd_extract_images(args):
+    """Extract the embedded images of a PDF into a ZIP"""
+    result = docs.extract_images(args.input, pages=args.pages, min_width=args.min_width,
+                                 min_height=args.min_height, min_bytes=args.min_bytes)
+    write_result(result, args.output)
+    print(f"Wrote {args.output}")
+
+
+def cmd_stamp(args):
+    """Add a watermark and/or page or Bates numbers to a PDF"""
+    result = docs.stamp_pdf(args.input, text=args.text, number_format=args.numbers, start_number=args.start,
+                            pages=args.pages, position=args.position, number_position=args.number_position,
+                            font_size=args.font_size, opacity=args.opacity, color=args.color)
+    write_result(result, args.output)
+    print(f"Wrote {args.output}")
+
+
+def cmd_organize(args):
+    """Reorder, rotate, delete or extract pages of a PDF"""
+    output = {"profile": args.profile, "strip_metadata": args.strip_metadata}
+    result = docs.organize_pages(args.input, order=args.order, rotate=args.rotate, delete=args.delete, output=output)
+    write_result(result, args.output)
+    print(f"Wrote {args.output}")
+
+
+def cmd_compare(args):
+    """Compare two revisions of a PDF into an annotated PDF or an HTML report"""
+    report = "html" if args.output.lower().endswith((".html", ".htm")) else "pdf"
+    result = docs.compare_pdfs([args.old, args.new], report=report, pixel_diff=args.pixel_diff, dpi=args.dpi)
+    write_result(result, args.output)
+    print(f"Wrote {args.output}")
+
+
+def cmd_export_text(args):
+    """Export the text of PDFs page by page, writing each page as it is extracted"""
+    out = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+    try:
+        for source in docs.expand_sources(args.inputs, docs.PDF_EXTENSIONS, args.include, args.exclude):
+            for chunk in docs.pdf_to_text(source, args.format, pages=args.pages, processes=args.jobs):
+                out.write(chunk)
+            out.flush()
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    if args.output != "-":
+        print(f"Wrote {args.output}")
+
+
+def cmd_benchmark(args):
+    """Time every installed backend on a corpus and record the results"""
+    results = backends.run_benchmark(args.corpus, args.conversion, args.backend, args.repeat, args.results)
+    print(f"{'conversion':<14} {'backend':<12} {'runs':>5} {'fail':>5} {'median ms':>10} {'files/s':>8} {'MB/s':>7}")
+    for conversion, by_backend in results.items():
+        for name, result in by_backend.items():
+            median = f"{result['median_ms']:.1f}" if result["median_ms"] is not None else "-"
+            files_per_s = f"{result['files_per_s']:.2f}" if result["files_per_s"] else "-"
+            mb_per_s = f"{result['mb_per_s']:.2f}" if result["mb_per_s"] else "-"
+            print(f"{conversion:<14} {name:<12} {result['runs']:>5} {result['failures']:>5} "
+                  f"{median:>10} {files_per_s:>8} {mb_per_s:>7}")
+    for conversion in results:
+        if conversion in backends.BACKENDS:
+            print(f"Selected for {conversion}: {backends.choose_backend(conversion, args.results)}")
+
+
+def cmd_upload(args):
+    """Send a large file to the app's upload server in resumable chunks"""
+    mb = 1024 * 1024
+
+    def progress(done, total):
+        print(f"\r  {done / mb:.1f} of {total / mb:.1f} MB", end="", flush=True)
+
+    uploads.upload_file(args.input, args.url, chunk_size=args.chunk_mb * mb, progress=progress)
+    print(f"\nUploaded {args.input}; choose it under Large files in the app.")
+
+
+def add_filter_arguments(parser):
+    parser.add_argument("--include", help="Only use files in folders and archives matching these globs (comma-separated)")
+    parser.add_argument("--exclude", help="Skip files in folders and archives matching these globs (comma-separated)")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Advanced Document Converter")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pipeline = subparsers.add_parser("pipeline", help="Run several PDF operations with a single parse and save")
+    pipeline.add_argument("inputs", nargs="+", help="Input PDF files, folders or ZIP/TAR archives of PDFs")
+    pipeline.add_argument("-s", "--step", action="append", type=parse_step,
+                          help=f"Step to run, in order: one of {', '.join(docs.PIPELINE_STEPS)} with key=value options")
+    pipeline.add_argument("--recipe", help="JSON file containing the list of steps")
+    pipeline.add_argument("-o", "--output", required=True, help="Output file (.pdf, or .zip when splitting)")
+    pipeline.add_argument("--profile", choices=list(docs.OUTPUT_PROFILES), default="standard",
+                          help="web = linearized fast web view, compact = object and xref streams")
+    pipeline.add_argument("--strip-metadata", action="store_true", help="Remove document info and XMP metadata")
+    add_filter_arguments(pipeline)
+    pipeline.set_defaults(func=cmd_pipeline)
+
+    images = subparsers.add_parser("images-to-pdf", help="Put images into a PDF, one per page")
+    images.add_argument("inputs", nargs="+", help="Image files, folders or ZIP/TAR archives of images")
+    images.add_argument("-o", "--output", required=True, help="Output PDF file")
+    add_filter_arguments(images)
+    images.set_defaults(func=cmd_images_to_pdf)
+
+    extract = subparsers.add_parser("extract-images", help="Extract embedded images without rendering pages")
+    extract.add_argument("input", help="Input PDF file")
+    extract.add_argument("-o", "--output", required=True, help="Output ZIP file")
+    extract.add_argument("--pages", help="Page selection such as 1-5,8,10-")
+    extract.add_argument("--min-width", type=int, default=0, help="Skip images narrower than this (pixels)")
+    extract.add_argument("--min-height", type=int, default=0, help="Skip images shorter than this (pixels)")
+    extract.add_argument("--min-bytes", type=int, default=0, help="Skip images smaller than this (bytes)")
+    extract.set_defaults(func=cmd_extract_images)
+
+    stamp = subparsers.add_parser("stamp", help="Add a watermark, stamp, page numbers or Bates numbers")
+    stamp.add_argument("input", help="Input PDF file")
+    stamp.add_argument("-o", "--output", required=True, help="Output PDF file")
+    stamp.add_argument("--text", help="Watermark or stamp text")
+    stamp.add_argument("--position", choices=docs.STAMP_POSITIONS, default="diagonal", help="Where the text goes")
+    stamp.add_argument("--font-size", type=float, help="Text size in points (default: fit the page)")
+    stamp.add_argument("--opacity", type=float, default=0.25, help="Text opacity between 0 and 1")
+    stamp.add_argument("--color", default="#ff0000", help="Text colour as #rrggbb")
+    stamp.add_argument("--numbers", help='Number format with {n} and {total}, e.g. "Page {n} of {total}" or "ABC{n:06d}"')
+    stamp.add_argument("--start", type=int, default=1, help="Number of the first stamped page")
+    stamp.add_argument("--number-position", choices=docs.NUMBER_POSITIONS, default="bottom-right")
+    stamp.add_argument("--pages", help="Page selection such as 1-5,8,10-")
+    stamp.set_defaults(func=cmd_stamp)
+
+    organize = subparsers.add_parser("organize", help="Reorder, rotate, delete or extract pages")
+    organize.add_argument("input", help="Input PDF file")
+    organize.add_argument("-o", "--output", required=True, help="Output PDF file")
+    organize.add_argument("--order", help="New page order such as 3,1-2,10-5; pages left out are removed")
+    organize.add_argument("--rotate", help="Clockwise rotations to add, such as 1-3:90,7:180")
+    organize.add_argument("--delete", help="Pages to remove, such as 2,5-6")
+    organize.add_argument("--profile", choices=list(docs.OUTPUT_PROFILES), default="standard",
+                          help="web = linearized fast web view, compact = object and xref streams")
+    organize.add_argument("--strip-metadata", action="store_true", help="Remove document info and XMP metadata")
+    organize.set_defaults(func=cmd_organize)
+
+    compare = subparsers.add_parser("compare", help="Show what changed between two revisions of a PDF")
+    compare.add_argument("old", help="Old revision")
+    compare.add_argument("new", help="New revision")
+    compare.add_argument("-o", "--output", required=True,
+                         help="Output file: .html for a report, else the new revision with the changes annotated")
+    compare.add_argument("--pixel-diff", action="store_true", help="Also compare how changed pages look")
+    compare.add_argument("--dpi", type=int, default=docs.COMPARE_DPI, help="Resolution of the pixel comparison")
+    compare.set_defaults(func=cmd_compare)
+
+    export = subparsers.add_parser("export-text", help="Export text as Markdown, JSON Lines or plain text")
+    export.add_argument("inputs", nargs="+", help="Input PDF files, folders or ZIP/TAR archives of PDFs")
+    export.add_argument("-o", "--output", required=True, help="Output file, or - for standard output")
+    export.add_argument("-f", "--format", choices=list(docs.TEXT_FORMATS), default="markdown",
+                        help="jsonl = one JSON object per page with text blocks and their coordinates")
+    export.add_argument("--pages", help="Page selection such as 1-5,8,10- (applied to each input)")
+    export.add_argument("-j", "--jobs", type=int, default=1, help="Extract pages in this many processes")
+    add_filter_arguments(export)
+    export.set_defaults(func=cmd_export_text)
+
+    benchmark = subparsers.add_parser("benchmark", help="Measure every installed conversion backend on a corpus")
+    benchmark.add_argument("corpus", help="Folder of sample documents (.docx, .xlsx, .pdf)")
+    benchmark.add_argument("-c", "--conversion", action="append", choices=list(backends.BACKENDS),
+                           help="Only benchmark this conversion (repeatable)")
+    benchmark.add_argument("-b", "--backend", action="append", help="Only benchmark this backend (repeatable)")
+    benchmark.add_argument("--repeat", type=int, default=3, help="Runs per file and backend")
+    benchmark.add_argument("--results", default=backends.BENCHMARK_FILE,
+                           help="JSON file the results are merged into (read by automatic backend selection)")
+    benchmark.set_defaults(func=cmd_benchmark)
+
+    upload = subparsers.add_parser("upload", help="Upload a large file to the app without holding it in memory")
+    upload.add_argument("input", help="File to upload")
+    upload.add_argument("url", help="Address of the upload page shown under Large files in the app")
+    upload.add_argument("--chunk-mb", type=int, default=8, help="Size of each chunk in MB")
+    upload.set_defaults(func=cmd_upload)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,602 @@
+"""Resource governor and admission control for conversions.
+
+Every conversion goes through three stages:
+
+1. ``inspect_input`` reads cheap facts about the upload (file size, page
+   count, embedded image count, image pixels) without rendering anything.
+   Uploads are spooled to the job directory first and inspected there.
+2. ``admit`` turns those facts into a cost estimate for the requested
+   operation. It rejects jobs over the hard limits. Jobs above
+   ``QUEUE_COST`` must wait for one of the few heavy-job slots (``job_slot``).
+3. ``run_limited`` runs the converter in a forked child process with
+   RLIMIT_AS / RLIMIT_CPU limits and a wall-clock timeout, so a malformed or
+   hostile file cannot take down or stall the shared server.
+
+Children are forked from a warm worker server that has already imported the
+converter libraries and run one tiny conversion of each kind (see
+workers.py), so a job does not pay for library start-up. Inputs are handed
+to workers as files in a per-job directory and results come back as files,
+so no document is pickled.
+
+Limits can be tuned per deployment with ``ADC_*`` environment variables.
+"""
+import inspect
+import multiprocessing
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import types
+import zipfile
+from contextlib import contextmanager
+from io import BytesIO
+
+import fitz  # PyMuPDF
+from PIL import Image
+
+import docs
+import workers
+
+
+def env_int(name, default):
+    """Read an integer setting from the environment, falling back to default"""
+    try:
+        return int(os.environ.get(name, default))
+    except ValueError:
+        return default
+
+
+MB = 1024 * 1024
+
+# Hard limits: anything above these is rejected before work starts
+MAX_FILE_SIZE = env_int("ADC_MAX_FILE_SIZE_MB", 200) * MB
+# Files on disk (large-file uploads, see uploads.py) are opened lazily, so they may be larger
+MAX_UPLOAD_SIZE = env_int("ADC_MAX_UPLOAD_SIZE_MB", 4096) * MB
+MAX_PAGES = env_int("ADC_MAX_PAGES", 2000)
+MAX_IMAGES = env_int("ADC_MAX_IMAGES", 10000)
+MAX_COST = env_int("ADC_MAX_COST", 20000)
+
+# Jobs costing more than QUEUE_COST share HEAVY_SLOTS slots; the rest run at once
+QUEUE_COST = env_int("ADC_QUEUE_COST", 2000)
+HEAVY_SLOTS = env_int("ADC_HEAVY_SLOTS", 1)
+QUEUE_TIMEOUT = env_int("ADC_QUEUE_TIMEOUT", 300)
+
+# Bytes read from an image in a compressed TAR to find its size
+IMAGE_HEADER_BYTES = 256 * 1024
+
+# Per-job sandbox limits
+MEMORY_LIMIT = env_int("ADC_MEMORY_LIMIT_MB", 2048) * MB
+CPU_LIMIT = env_int("ADC_CPU_LIMIT", 120)
+TIMEOUT = env_int("ADC_TIMEOUT", 180)
+
+# Fork jobs from the warm worker server (0 forks the calling process instead)
+WARM_WORKERS = env_int("ADC_WARM_WORKERS", 1)
+WORK_DIR = os.environ.get("ADC_WORK_DIR", "temp")
+
+# Cost weights per operation: (per page, per embedded image, per MB, per megapixel)
+COST_WEIGHTS = {
+    "pdf_to_word": (1, 0, 1, 0),
+    "word_to_pdf": (0, 0, 20, 0),
+    "excel_to_pdf": (0, 0, 20, 0),
+    "pdf_to_pptx": (2, 0, 1, 0),
+    "pdf_to_jpg": (0, 0, 1, 0),
+    "pdf_pages_to_jpg": (3, 0, 1, 0),
+    "jpg_to_pdf": (0, 0, 1, 2),
+    "pdf_to_excel": (2, 0, 1, 0),
+    "merge_pdfs": (1, 0, 1, 0),
+    "split_pdf": (2, 0, 1, 0),
+    "compress_pdf": (1, 10, 2, 0),
+    "extract_images": (1, 1, 1, 0),
+    "stamp_pdf": (1, 0, 1, 0),
+    "organize_pages": (1, 0, 1, 0),
+    "compare_pdfs": (3, 0, 1, 0),
+    "pdf_to_text": (1, 0, 1, 0),
+    "run_pipeline": (3, 10, 2, 0),
+}
+DEFAULT_WEIGHTS = (2, 2, 2, 2)
+
+_heavy_jobs = threading.BoundedSemaphore(HEAVY_SLOTS)
+
+
+class ConversionRejected(Exception):
+    """The job exceeds the limits of this server"""
+
+
+class ConversionTimeout(Exception):
+    """The job ran longer than the wall-clock limit and was killed"""
+
+
+class ConversionFailed(Exception):
+    """The job failed or its worker process died"""
+
+
+def inspect_pdf(data):
+    """Return page and embedded image counts without loading any page"""
+    if isinstance(data, (str, os.PathLike)):
+        pdf_document = fitz.open(data)
+    else:
+        pdf_document = fitz.open(stream=data, filetype="pdf")
+    try:
+        pages = len(pdf_document)
+        images = 0
+        # Walking the xref table only touches object dictionaries, not streams
+        for xref in range(1, pdf_document.xref_length()):
+            if pdf_document.xref_is_image(xref):
+                images += 1
+                if images > MAX_IMAGES:
+                    break
+        return {"pages": pages, "images": images}
+    finally:
+        pdf_document.close()
+
+
+def inspect_image(data):
+    """Return the pixel count of an image by reading only its header"""
+    with docs.open_image(data) as img:
+        width, height = img.size
+        frames = getattr(img, "n_frames", 1)
+    return {"images": frames, "pixels": width * height * frames}
+
+
+def _file_or_buffer(data):
+    """Open a path for reading, or wrap bytes in a BytesIO"""
+    return open(data, "rb") if isinstance(data, (str, os.PathLike)) else BytesIO(data)
+
+
+def _image_header(f):
+    """Frame count and pixels of an image file object, reading only its header"""
+    with Image.open(f) as img:
+        width, height = img.size
+        frames = getattr(img, "n_frames", 1)
+    return frames, width * height * frames
+
+
+def _streamed_image_header(f):
+    """_image_header for a TAR member; seeking back in a compressed TAR restarts it
+
+    Only the first IMAGE_HEADER_BYTES are read.
+    """
+    return _image_header(BytesIO(f.read(IMAGE_HEADER_BYTES)))
+
+
+def _inspect_member_pdf(f):
+    """inspect_pdf for a PDF inside an archive, spooled to a scratch file first
+
+    PyMuPDF then reads the copy lazily instead of needing it all in memory.
+    """
+    os.makedirs(WORK_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=WORK_DIR, suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            shutil.copyfileobj(f, spool, 1024 * 1024)
+        return inspect_pdf(path)
+    finally:
+        os.unlink(path)
+
+
+def inspect_collection(source):
+    """Count the pages and images in a folder or archive, without extracting it
+
+    PDFs are opened to count their pages and embedded images, like single
+    uploads. Images are counted by frames and pixels from their headers.
+    size is the unpacked size, so archives that expand far beyond their own
+    size are caught by the size limit; once it is exceeded nothing more is
+    read.
+    """
+    stats = {"pages": 0, "images": 0, "pixels": 0, "size": 0}
+
+    def add(name, size, inspect_member_pdf, read_header):
+        is_pdf = docs.matches_filters(name, docs.PDF_EXTENSIONS)
+        if not is_pdf and not docs.matches_filters(name, docs.IMAGE_EXTENSIONS):
+            return
+        stats["size"] += size
+        if stats["size"] > MAX_UPLOAD_SIZE:
+            return  # rejected on its size anyway
+        if is_pdf:
+            found = inspect_member_pdf()
+            stats["pages"] += found["pages"]
+            stats["images"] += found["images"]
+            return
+        try:
+            frames, pixels = read_header()
+        except Exception:
+            # Unreadable headers are charged as the largest image Pillow will open
+            frames, pixels = 1, Image.MAX_IMAGE_PIXELS
+        stats["images"] += frames
+        stats["pixels"] += pixels
+
+    def read_file(path):
+        with open(path, "rb") as f:
+            return _image_header(f)
+
+    def open_and(read, open_member):
+        with open_member() as f:
+            return read(f)
+
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        for root, _, files in os.walk(source):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                add(os.path.relpath(path, source), size,
+                    lambda path=path: inspect_pdf(path), lambda path=path: read_file(path))
+        return stats
+
+    with _file_or_buffer(source) as f:
+        is_zip = zipfile.is_zipfile(f)
+        f.seek(0)
+        if is_zip:
+            with zipfile.ZipFile(f) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        open_member = lambda info=info: archive.open(info)
+                        add(info.filename, info.file_size,
+                            lambda open_member=open_member: open_and(_inspect_member_pdf, open_member),
+                            lambda open_member=open_member: open_and(_image_header, open_member))
+        else:
+            # Members are visited in archive order, so a compressed stream is only read forwards
+            with tarfile.open(fileobj=f, mode="r:*") as archive:
+                for member in archive:
+                    if member.isfile():
+                        open_member = lambda member=member: archive.extractfile(member)
+                        add(member.name, member.size,
+                            lambda open_member=open_member: open_and(_inspect_member_pdf, open_member),
+                            lambda open_member=open_member: open_and(_streamed_image_header, open_member))
+    return stats
+
+    with _file_or_buffer(source) as f:
+        is_zip = zipfile.is_zipfile(f)
+        f.seek(0)
+        if is_zip:
+            with zipfile.ZipFile(f) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        add(info.filename, info.file_size, lambda info=info: read_member(archive, info))
+        else:
+            # Members are visited in archive order, so a compressed stream is only read forwards
+            with tarfile.open(fileobj=f, mode="r:*") as archive:
+                for member in archive:
+                    if member.isfile():
+                        add(member.name, member.size,
+                            lambda member=member: _streamed_image_header(archive.extractfile(member)))
+    return stats
+
+
+def _memory_size(source):
+    """Size of an in-memory upload, without copying it"""
+    if hasattr(source, "getbuffer"):
+        with source.getbuffer() as view:
+            return view.nbytes
+    return len(source)
+
+
+def _starts_with_pdf_header(data):
+    if isinstance(data, (str, os.PathLike)):
+        with open(data, "rb") as f:
+            return f.read(5) == b"%PDF-"
+    return bytes(data[:5]) == b"%PDF-"
+
+
+def inspect_input(sources, spooled=None):
+    """Collect cheap statistics about one upload or a list of uploads
+
+    spooled holds the same uploads written to disk (see _spool_sources); the
+    files are then parsed there, so in-memory uploads are measured but never
+    copied. Without it, in-memory uploads are read from memory.
+    """
+    if not isinstance(sources, (list, tuple)):
+        sources = [sources]
+        spooled = None if spooled is None else [spooled]
+
+    stats = {"files": len(sources), "size": 0, "in_memory": 0, "pages": 0, "images": 0, "pixels": 0}
+    for index, source in enumerate(sources):
+        # Folders and archives count by their unpacked size (see inspect_collection)
+        is_collection = docs.is_collection(source)
+        if isinstance(source, (str, os.PathLike)):
+            data = name = os.fspath(source)
+            if not is_collection:
+                stats["size"] += os.path.getsize(data)
+            name = name.lower()
+        else:
+            size = _memory_size(source)
+            data = spooled[index] if spooled is not None else docs.read_source(source)
+            name = getattr(source, "name", "").lower()
+            if not is_collection:
+                stats["size"] += size
+            stats["in_memory"] += size
+        if stats["in_memory"] > MAX_FILE_SIZE or stats["size"] > MAX_UPLOAD_SIZE:
+            # No need to parse anything once the size limit is blown
+            break
+
+        try:
+            if is_collection:
+                found = inspect_collection(data)
+            elif name.endswith(".pdf") or _starts_with_pdf_header(data):
+                found = inspect_pdf(data)
+            elif name.endswith((".doc", ".docx", ".xls", ".xlsx")):
+                found = {}
+            else:
+                found = inspect_image(data)
+        except Exception as e:
+            raise ConversionRejected(f"Could not read {name or 'the file'}: {e}")
+
+        for key, value in found.items():
+            stats[key] += value
+    return stats
+
+
+def apply_page_selection(stats, pages):
+    """Scale the statistics of a single PDF down to the pages a job will touch"""
+    total = stats["pages"]
+    if stats["files"] != 1 or not total:
+        return stats
+    try:
+        selected = len(docs.parse_page_selection(pages, total))
+    except ValueError as e:
+        raise ConversionRejected(str(e))
+    # Embedded images are counted per document; assume they are spread evenly
+    stats["images"] = -(-stats["images"] * selected // total)
+    stats["pages"] = selected
+    return stats
+
+
+def job_pages(func, args, kwargs):
+    """The page selection a call of func(source, *args, **kwargs) touches, or None for all pages
+
+    Usually its ``pages`` argument; a split_pdf "range" job gives its pages
+    as start_page and end_page instead.
+    """
+    try:
+        call = inspect.signature(func).bind(None, *args, **kwargs)
+    except (TypeError, ValueError):
+        return kwargs.get("pages")
+    call.apply_defaults()
+    arguments = call.arguments
+    if arguments.get("split_type") == "range":
+        return f"{arguments['start_page']}-{arguments['end_page']}"
+    return arguments.get("pages")
+
+
+def estimate_cost(operation, stats):
+    """Estimate the cost of running an operation on inputs described by stats"""
+    per_page, per_image, per_mb, per_mpixel = COST_WEIGHTS.get(operation, DEFAULT_WEIGHTS)
+    return int(
+        per_page * stats["pages"]
+        + per_image * stats["images"]
+        + per_mb * stats["size"] / MB
+        + per_mpixel * stats["pixels"] / 1_000_000
+    )
+
+
+def admit(operation, stats):
+    """Return the estimated cost of a job or raise ConversionRejected"""
+    if stats["in_memory"] > MAX_FILE_SIZE:
+        raise ConversionRejected(
+            f"Input is {stats['in_memory'] / MB:.1f} MB; the limit is {MAX_FILE_SIZE / MB:.0f} MB. "
+            "Use the large-file upload for bigger files."
+        )
+    if stats["size"] > MAX_UPLOAD_SIZE:
+        raise ConversionRejected(
+            f"Input is {stats['size'] / MB:.1f} MB; the limit is {MAX_UPLOAD_SIZE / MB:.0f} MB."
+        )
+    if stats["pages"] > MAX_PAGES:
+        raise ConversionRejected(f"Input has {stats['pages']} pages; the limit is {MAX_PAGES}.")
+    if stats["images"] > MAX_IMAGES:
+        raise ConversionRejected(f"Input has more than {MAX_IMAGES} images.")
+
+    cost = estimate_cost(operation, stats)
+    if cost > MAX_COST:
+        raise ConversionRejected(
+            f"This job is too large for this server (estimated cost {cost}, limit {MAX_COST}). "
+            "Try splitting the file first."
+        )
+    return cost
+
+
+def needs_queue(cost):
+    """Whether a job of this cost has to wait for a heavy-job slot"""
+    return cost > QUEUE_COST
+
+
+@contextmanager
+def job_slot(cost):
+    """Hold a heavy-job slot for expensive jobs; cheap jobs pass straight through"""
+    if not needs_queue(cost):
+        yield
+        return
+    if not _heavy_jobs.acquire(timeout=QUEUE_TIMEOUT):
+        raise ConversionRejected("The server is busy with other large jobs. Please try again later.")
+    try:
+        yield
+    finally:
+        _heavy_jobs.release()
+
+
+def start_workers():
+    """Start the warm worker server now instead of on the first job"""
+    if WARM_WORKERS and hasattr(os, "fork"):
+        workers.ensure_running()
+
+
+def _run_forked(func, args, kwargs, timeout, memory_limit, cpu_limit, result_path):
+    """Run a job in a child forked from this process; return (status, payload)"""
+    ctx = multiprocessing.get_context("fork")
+    recv_conn, send_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(
+        target=workers.run_job,
+        args=(send_conn, func, args, kwargs, memory_limit, cpu_limit, result_path, time.monotonic() + timeout),
+        daemon=True,
+    )
+    process.start()
+    send_conn.close()
+
+    try:
+        if not recv_conn.poll(timeout):
+            workers.kill_job(process.pid)
+            raise ConversionTimeout(f"The conversion took longer than {timeout} seconds and was stopped.")
+        try:
+            return recv_conn.recv()
+        except EOFError:
+            process.join()
+            raise ConversionFailed(
+                f"The conversion process exited unexpectedly (exit code {process.exitcode})."
+            )
+    finally:
+        recv_conn.close()
+        process.join(timeout=5)
+        if process.is_alive():
+            workers.kill_job(process.pid)
+            process.join()
+
+
+def _run_warm(func, args, kwargs, timeout, memory_limit, cpu_limit, result_path):
+    """Run a job in a worker forked from the warm server; return (status, payload)"""
+    try:
+        conn, pid = workers.submit(func, args, kwargs, memory_limit, cpu_limit, result_path,
+                                   time.monotonic() + timeout)
+    except EOFError:
+        raise ConversionFailed("The worker could not load the job.")
+
+    try:
+        if not conn.poll(timeout):
+            workers.kill_job(pid)
+            raise ConversionTimeout(f"The conversion took longer than {timeout} seconds and was stopped.")
+        try:
+            return conn.recv()
+        except EOFError:
+            raise ConversionFailed("The conversion process exited unexpectedly.")
+    finally:
+        conn.close()
+
+
+def run_limited(func, *args, timeout=None, memory_limit=None, cpu_limit=None, result_path=None, **kwargs):
+    """Run func(*args, **kwargs) in a resource-limited child process and return its result
+
+    The child comes from the warm worker server, or is forked from this
+    process when ADC_WARM_WORKERS=0. Falls back to running in-process on
+    platforms without fork().
+
+    With result_path, a document result is written to that file and the path
+    is returned instead of a BytesIO, so it never passes through this process.
+    """
+    timeout = TIMEOUT if timeout is None else timeout
+    memory_limit = MEMORY_LIMIT if memory_limit is None else memory_limit
+    cpu_limit = CPU_LIMIT if cpu_limit is None else cpu_limit
+
+    if not hasattr(os, "fork"):
+        result = func(*args, **kwargs)
+        if isinstance(result, docs.ResultFile):
+            if result_path is None:
+                with open(result, "rb") as f:
+                    payload = BytesIO(f.read())
+                result.discard()
+                return payload
+            result.move_to(result_path)
+            return result_path
+        if isinstance(result, types.GeneratorType):
+            # Streamed output; without a result file it is collected in memory
+            if result_path is None:
+                return BytesIO(b"".join(result))
+            with open(result_path, "wb") as f:
+                for chunk in result:
+                    f.write(chunk)
+            return result_path
+        if result_path is not None and isinstance(result, BytesIO):
+            with open(result_path, "wb") as f:
+                f.write(result.getbuffer())
+            return result_path
+        return result
+
+    keep_result = result_path is not None
+    if not keep_result:
+        os.makedirs(WORK_DIR, exist_ok=True)
+        fd, result_path = tempfile.mkstemp(dir=WORK_DIR, suffix=".result")
+        os.close(fd)
+    result_path = os.path.abspath(result_path)
+
+    run = _run_warm if WARM_WORKERS else _run_forked
+    try:
+        status, payload = run(func, args, kwargs, timeout, memory_limit, cpu_limit, result_path)
+        if status == "file":
+            if keep_result:
+                payload = result_path
+            else:
+                with open(result_path, "rb") as f:
+                    payload = BytesIO(f.read())
+    finally:
+        if not keep_result:
+            os.unlink(result_path)
+
+    if status == "error":
+        raise ConversionFailed(payload)
+    return payload
+
+
+@contextmanager
+def _job_dir():
+    """A fresh directory for one job's spooled inputs, removed afterwards"""
+    os.makedirs(WORK_DIR, exist_ok=True)
+    job_dir = os.path.abspath(tempfile.mkdtemp(dir=WORK_DIR, prefix="job-"))
+    try:
+        yield job_dir
+    finally:
+        shutil.rmtree(job_dir, ignore_errors=True)
+
+
+def _spool_sources(sources, job_dir):
+    """Write uploads into job_dir and return their paths, keeping file names
+
+    Paths are passed through unchanged. Each upload gets its own
+    sub-directory so two uploads with the same name cannot collide.
+    """
+    if isinstance(sources, (list, tuple)):
+        return [_spool_sources(source, os.path.join(job_dir, str(index))) for index, source in enumerate(sources)]
+    if isinstance(sources, (str, os.PathLike)):
+        # Files already on disk are opened in place; workers get a plain path
+        return os.fspath(sources)
+
+    os.makedirs(job_dir, exist_ok=True)
+    path = os.path.join(job_dir, os.path.basename(getattr(sources, "name", "") or "input"))
+    with open(path, "wb") as f:
+        f.write(sources.getbuffer() if hasattr(sources, "getbuffer") else bytes(sources))
+    return path
+
+
+def run_governed(operation, func, sources, *args, on_queue=None, result_path=None, **kwargs):
+    """Inspect, admit and run a conversion under the governor
+
+    on_queue is called (e.g. to show a message) when the job has to wait for a slot.
+    result_path is passed on to run_limited.
+    The pages the converter will touch (a ``pages`` selection, or a split
+    range, see job_pages) also limit what is admitted, so a few pages of a
+    huge document are not rejected for the size of the whole.
+    """
+    with _job_dir() as job_dir:
+        # Uploads are written out first and inspected on disk, not copied in memory
+        paths = _spool_sources(sources, job_dir)
+        stats = inspect_input(sources, paths)
+        pages = job_pages(func, args, kwargs)
+        # In a folder or archive the selection applies to every PDF; the whole is charged
+        if pages is not None and not docs.is_collection(paths[0] if isinstance(paths, list) else paths):
+            apply_page_selection(stats, pages)
+        cost = admit(operation, stats)
+        if needs_queue(cost) and on_queue is not None:
+            on_queue(cost)
+        with job_slot(cost):
+            return run_limited(func, paths, *args, result_path=result_path, **kwargs)
+
+
+def run_spooled(func, sources, *args, **kwargs):
+    """Spool uploads to disk and run func on their paths with run_limited
+
+    Without admission control, for quick read-only helpers such as counting
+    pages or rendering previews, which still must not parse untrusted files
+    in the app's own process.
+    """
+    with _job_dir() as job_dir:
+        return run_limited(func, _spool_sources(sources, job_dir), *args, **kwargs)
@@ -0,0 +1,160 @@
+"""Conversion results kept on disk and served over HTTP.
+
+Handing a BytesIO to ``st.download_button`` keeps the whole file in the
+session and sends it again on every rerun. Instead, workers write each
+result straight into ``RESULT_DIR`` (``new_result_path``), and the app
+shows a link to it. The link points at the server in uploads.py, which
+streams the file with ``serve_file``:
+
+- Range requests (a single byte range) so downloads can resume and viewers
+  can fetch parts of a file.
+- A strong ETag and Last-Modified, with If-None-Match / If-Range support.
+- The file goes out through ``socket.sendfile`` without being read into
+  Python.
+
+Results live in a per-session inbox directory under an unguessable id and
+are deleted ``RESULT_TTL`` after they were written (``expire_results``).
+"""
+import email.utils
+import mimetypes
+import os
+import re
+import secrets
+import shutil
+import time
+from urllib.parse import quote
+
+import governor
+
+RESULT_DIR = os.environ.get("ADC_RESULT_DIR", os.path.join("output", "results"))
+RESULT_TTL = governor.env_int("ADC_RESULT_TTL_MINUTES", 60) * 60
+RESULT_FILE = "result"
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def new_result_path(inbox):
+    """Create an empty result slot for an inbox and return the path to write to"""
+    expire_results()
+    result_dir = os.path.join(RESULT_DIR, inbox, secrets.token_urlsafe(16))
+    os.makedirs(result_dir)
+    return os.path.abspath(os.path.join(result_dir, RESULT_FILE))
+
+
+def result_url(path, base_url, file_name):
+    """Download address of a stored result under the upload server's base URL"""
+    result_dir = os.path.dirname(os.fspath(path))
+    inbox = os.path.basename(os.path.dirname(result_dir))
+    result_id = os.path.basename(result_dir)
+    return f"{base_url.rstrip('/')}/{inbox}/results/{result_id}/{quote(file_name)}"
+
+
+def result_path(inbox, result_id):
+    """Path of a stored result; the caller checks that both ids are well formed"""
+    return os.path.join(RESULT_DIR, inbox, result_id, RESULT_FILE)
+
+
+def expire_results(now=None):
+    """Delete results written more than RESULT_TTL ago"""
+    now = time.time() if now is None else now
+    try:
+        inboxes = os.listdir(RESULT_DIR)
+    except OSError:
+        return
+    for inbox in inboxes:
+        inbox_dir = os.path.join(RESULT_DIR, inbox)
+        try:
+            result_ids = os.listdir(inbox_dir)
+        except OSError:
+            continue
+        for result_id in result_ids:
+            result_dir = os.path.join(inbox_dir, result_id)
+            try:
+                created = os.path.getmtime(result_dir)
+            except OSError:
+                continue
+            if now - created > RESULT_TTL:
+                shutil.rmtree(result_dir, ignore_errors=True)
+        try:
+            os.rmdir(inbox_dir)  # only succeeds once the inbox is empty
+        except OSError:
+            pass
+
+
+def parse_range(header, size):
+    """Parse a Range header for a file of the given size
+
+    Returns (start, end) inclusive, None to send the whole file (no usable
+    single range) or False when the range cannot be satisfied.
+    """
+    match = _RANGE.match(header.strip())
+    if not match:
+        return None  # malformed or multiple ranges: the whole file is a valid answer
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # "-N" is the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or (last and int(last) < start):
+        return False
+    return start, end
+
+
+def serve_file(handler, path, file_name):
+    """Answer a GET or HEAD for a stored file on a BaseHTTPRequestHandler"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        handler.send_error(404, "This download has expired. Please run the conversion again.")
+        return
+
+    size = stat.st_size
+    etag = f'"{stat.st_ino:x}-{size:x}-{stat.st_mtime_ns:x}"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+        "Accept-Ranges": "bytes",
+        "Cache-Control": f"private, max-age={max(0, int(stat.st_mtime + RESULT_TTL - time.time()))}",
+    }
+
+    if_none_match = handler.headers.get("If-None-Match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in (t.strip() for t in if_none_match.split(","))):
+        handler.send_response(304)
+        for key, value in headers.items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        return
+
+    status, start, end = 200, 0, size - 1
+    range_header = handler.headers.get("Range")
+    if_range = handler.headers.get("If-Range")
+    if range_header and (if_range is None or if_range.strip() == etag):
+        byte_range = parse_range(range_header, size)
+        if byte_range is False:
+            handler.send_response(416)
+            handler.send_header("Content-Range", f"bytes */{size}")
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+        if byte_range is not None:
+            status, (start, end) = 206, byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    length = end - start + 1
+    headers["Content-Length"] = str(length)
+    headers["Content-Type"] = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(file_name)}"
+
+    handler.send_response(status)
+    for key, value in headers.items():
+        handler.send_header(key, value)
+    handler.end_headers()
+    if handler.command == "GET" and length:
+        with open(path, "rb") as f:
+            handler.connection.sendfile(f, start, length)
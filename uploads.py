@@ -0,0 +1,541 @@
+"""Resumable, chunked uploads straight to disk for large files.
+
+Streamlit's file uploader keeps every upload in memory and is capped by
+``server.maxUploadSize``. Large scans instead go through a small HTTP server
+started next to the app. It writes each chunk to disk as it arrives, so
+memory use does not grow with the file size:
+
+- ``POST /<inbox>/uploads`` with ``Upload-Length`` and ``Upload-Name``
+  headers creates an upload and returns its URL in ``Location``.
+- ``HEAD <upload URL>`` reports how much has arrived (``Upload-Offset``),
+  so an interrupted upload resumes where it stopped.
+- ``PATCH <upload URL>`` with ``Upload-Offset`` appends one chunk.
+
+``GET /<inbox>/`` serves a page that does this from the browser, and
+``python cli.py upload`` does it from a script. The same server delivers
+finished conversions from ``GET /<inbox>/results/<id>/<name>`` (see
+results.py). Each app session has its own inbox, kept in the session
+(not in the URL), so sessions only see their own files. Inbox names are
+signed with a server secret; the server only accepts inboxes it issued,
+and uploads count against a per-inbox and a total quota. Finished files are
+listed with ``list_uploads`` as ``StoredFile`` objects. These act as paths,
+so converters open them lazily (``fitz.open(path)``) instead of reading them
+into memory.
+
+Files that already sit on the server can be used without uploading them:
+the folders listed in ``ADC_INPUT_DIRS`` (and their sub-folders) are offered
+by ``list_input_folders`` as inputs for tools that take many files.
+"""
+import base64
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import re
+import secrets
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urljoin
+
+import docs
+import governor
+import results
+
+UPLOAD_DIR = os.environ.get("ADC_UPLOAD_DIR", os.path.join("temp", "uploads"))
+UPLOAD_HOST = os.environ.get("ADC_UPLOAD_HOST", "127.0.0.1")
+UPLOAD_PORT = governor.env_int("ADC_UPLOAD_PORT", 8502)
+# Public address of the upload server when it sits behind a proxy, e.g. https://files.example.com
+UPLOAD_URL = os.environ.get("ADC_UPLOAD_URL")
+UPLOAD_TTL = governor.env_int("ADC_UPLOAD_TTL_HOURS", 24) * 3600
+# Bytes that may be stored (declared upload lengths) per inbox and in total
+INBOX_QUOTA = governor.env_int("ADC_INBOX_QUOTA_MB", 8192) * governor.MB
+TOTAL_QUOTA = governor.env_int("ADC_UPLOAD_QUOTA_MB", 32768) * governor.MB
+# Signs inbox names; a random key means inboxes do not outlive the process
+SECRET_KEY = os.environ.get("ADC_SECRET_KEY", "").encode() or secrets.token_bytes(32)
+UPLOAD_EXTENSIONS = (".pdf", ".docx", ".doc", ".xlsx", ".xls") + docs.IMAGE_EXTENSIONS + docs.ARCHIVE_EXTENSIONS
+# The upload page's file picker filter; browsers match only the last extension
+_ACCEPT = ",".join(dict.fromkeys("." + extension.rsplit(".", 1)[1] for extension in UPLOAD_EXTENSIONS))
+# Server folders whose files may be used as inputs, separated by os.pathsep
+INPUT_DIRS = [os.path.abspath(d) for d in os.environ.get("ADC_INPUT_DIRS", "").split(os.pathsep) if d]
+
+CHUNK_SIZE = 1024 * 1024
+_TOKEN = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+_INBOX_ID_LENGTH = 22  # secrets.token_urlsafe(16); the signature follows
+_PARTIAL = ".part"
+
+_server = None
+_server_lock = threading.Lock()
+_quota_lock = threading.Lock()
+_upload_locks = {}  # upload directory -> lock, while the upload is unfinished
+
+
+class StoredFile(os.PathLike):
+    """A finished upload on disk, with the ``name`` and ``size`` of an UploadedFile"""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.name = os.path.basename(path)
+        self.size = os.path.getsize(path)
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self):
+        return f"StoredFile({self.path!r})"
+
+
+def _sign(inbox_id):
+    digest = hmac.new(SECRET_KEY, inbox_id.encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:16]).decode().rstrip("=")
+
+
+def new_inbox():
+    """Return a fresh inbox name for one app session: a random id and its signature"""
+    inbox_id = secrets.token_urlsafe(16)
+    return inbox_id + _sign(inbox_id)
+
+
+def is_inbox(inbox):
+    """Whether a string is an inbox name issued by this server"""
+    if not _TOKEN.match(inbox or "") or len(inbox) <= _INBOX_ID_LENGTH:
+        return False
+    inbox_id, signature = inbox[:_INBOX_ID_LENGTH], inbox[_INBOX_ID_LENGTH:]
+    return hmac.compare_digest(_sign(inbox_id), signature)
+
+
+def _inbox_dir(inbox):
+    if not is_inbox(inbox):
+        raise ValueError("Invalid inbox.")
+    return os.path.join(UPLOAD_DIR, inbox)
+
+
+def _is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError:
+        return False
+
+
+def base_url(host, port):
+    """Address of this server as seen from a browser that reached the app at host
+
+    Returns None when that browser cannot reach it: the server listens on
+    loopback only, the browser is on another machine and no ADC_UPLOAD_URL
+    proxy is configured.
+    """
+    if UPLOAD_URL:
+        return UPLOAD_URL.rstrip("/")
+    if _is_loopback(UPLOAD_HOST) and not _is_loopback(host):
+        return None
+    return f"http://{host}:{port}"
+
+
+def list_input_folders():
+    """Return the input folders from ADC_INPUT_DIRS and their direct sub-folders"""
+    folders = []
+    for root in INPUT_DIRS:
+        if not os.path.isdir(root):
+            continue
+        folders.append(root)
+        try:
+            entries = sorted(os.scandir(root), key=lambda entry: docs.natural_sort_key(entry.name))
+        except OSError:
+            continue
+        folders.extend(entry.path for entry in entries
+                       if entry.is_dir(follow_symlinks=False) and not entry.name.startswith("."))
+    return folders
+
+
+def list_uploads(inbox, extensions=None):
+    """Return the finished uploads of an inbox, newest first"""
+    try:
+        root = _inbox_dir(inbox)
+        upload_ids = os.listdir(root)
+    except (ValueError, OSError):
+        return []
+
+    files = []
+    for upload_id in upload_ids:
+        try:
+            with open(os.path.join(root, upload_id, "upload.json")) as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            continue
+        path = os.path.join(root, upload_id, info["name"])
+        if not os.path.exists(path):
+            continue  # still uploading
+        if extensions and not info["name"].lower().endswith(tuple(extensions)):
+            continue
+        files.append(StoredFile(path))
+    files.sort(key=lambda f: os.path.getmtime(f.path), reverse=True)
+    return files
+
+
+def expire_uploads(now=None):
+    """Delete uploads (finished or not) that were last touched more than UPLOAD_TTL ago"""
+    now = time.time() if now is None else now
+    try:
+        inboxes = os.listdir(UPLOAD_DIR)
+    except OSError:
+        return
+    for inbox in inboxes:
+        inbox_dir = os.path.join(UPLOAD_DIR, inbox)
+        try:
+            upload_dirs = os.listdir(inbox_dir)
+        except OSError:
+            continue
+        for upload_id in upload_dirs:
+            upload_dir = os.path.join(inbox_dir, upload_id)
+            try:
+                touched = max(os.path.getmtime(os.path.join(upload_dir, name)) for name in os.listdir(upload_dir))
+            except (OSError, ValueError):
+                touched = 0
+            if now - touched > UPLOAD_TTL:
+                shutil.rmtree(upload_dir, ignore_errors=True)
+                _upload_locks.pop(upload_dir, None)
+        try:
+            os.rmdir(inbox_dir)  # only succeeds once the inbox is empty
+        except OSError:
+            pass
+
+
+def stored_bytes(inbox=None):
+    """Declared size of the uploads (finished or not) of one inbox, or of all inboxes"""
+    if inbox is not None:
+        inbox_dirs = [_inbox_dir(inbox)]
+    else:
+        try:
+            inbox_dirs = [os.path.join(UPLOAD_DIR, name) for name in os.listdir(UPLOAD_DIR)]
+        except OSError:
+            return 0
+    total = 0
+    for inbox_dir in inbox_dirs:
+        try:
+            upload_ids = os.listdir(inbox_dir)
+        except OSError:
+            continue
+        for upload_id in upload_ids:
+            try:
+                with open(os.path.join(inbox_dir, upload_id, "upload.json")) as f:
+                    total += int(json.load(f)["length"])
+            except (OSError, ValueError, KeyError, TypeError):
+                continue
+    return total
+
+
+def _safe_name(name):
+    """Reduce a client-supplied file name to a plain base name"""
+    name = os.path.basename(name.replace("\\", "/")).strip().lstrip(".")
+    return name or "upload"
+
+
+class UploadHandler(BaseHTTPRequestHandler):
+    """HTTP handler for the upload page and the resumable upload protocol"""
+
+    server_version = "ADCUpload/1.0"
+
+    def log_message(self, format, *args):
+        pass  # keep the app's console readable
+
+    def _route(self):
+        """Split the request path into (inbox directory, upload id or None, is_upload_path)"""
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        try:
+            inbox_dir = _inbox_dir(parts[0])
+        except ValueError:
+            return None, None, False
+        if len(parts) == 1:
+            return inbox_dir, None, False
+        if parts[1] != "uploads" or len(parts) > 3:
+            return None, None, False
+        upload_id = parts[2] if len(parts) == 3 else None
+        if upload_id is not None and not _TOKEN.match(upload_id):
+            return None, None, False
+        return inbox_dir, upload_id, True
+
+    def _result(self):
+        """Return (path, download name) when the request is for a stored result, else None"""
+        parts = self.path.split("?", 1)[0].strip("/").split("/")
+        if len(parts) != 4 or parts[1] != "results" or not (is_inbox(parts[0]) and _TOKEN.match(parts[2])):
+            return None
+        return results.result_path(parts[0], parts[2]), _safe_name(unquote(parts[3]))
+
+    def _load(self, inbox_dir, upload_id):
+        """Return (upload directory, info) or (None, None) if there is no such upload"""
+        upload_dir = os.path.join(inbox_dir, upload_id)
+        try:
+            with open(os.path.join(upload_dir, "upload.json")) as f:
+                return upload_dir, json.load(f)
+        except (OSError, ValueError):
+            return None, None
+
+    def _offset(self, upload_dir, info):
+        """Bytes received so far for an upload"""
+        final = os.path.join(upload_dir, info["name"])
+        if os.path.exists(final):
+            return info["length"]
+        try:
+            return os.path.getsize(final + _PARTIAL)
+        except OSError:
+            return 0
+
+    def _reply(self, status, headers=None, body=b""):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def do_GET(self):
+        result = self._result()
+        if result is not None:
+            results.serve_file(self, *result)
+            return
+        inbox_dir, upload_id, is_upload = self._route()
+        if inbox_dir is None or is_upload:
+            self.send_error(404)
+            return
+        body = (UPLOAD_PAGE.replace("{max_mb}", str(governor.MAX_UPLOAD_SIZE // governor.MB))
+                .replace("{accept}", _ACCEPT).encode())
+        self._reply(200, {"Content-Type": "text/html; charset=utf-8", "Cache-Control": "no-store"}, body)
+
+    def do_POST(self):
+        inbox_dir, upload_id, is_upload = self._route()
+        if not is_upload or upload_id is not None:
+            self.send_error(404)
+            return
+        try:
+            length = int(self.headers["Upload-Length"])
+        except (TypeError, ValueError):
+            self.send_error(400, "Upload-Length header required")
+            return
+        name = _safe_name(unquote(self.headers.get("Upload-Name", "")))
+        if not name.lower().endswith(UPLOAD_EXTENSIONS):
+            self.send_error(415, f"Unsupported file type; expected one of {', '.join(UPLOAD_EXTENSIONS)}")
+            return
+        if not 0 < length <= governor.MAX_UPLOAD_SIZE:
+            self.send_error(413, f"Files must be between 1 byte and {governor.MAX_UPLOAD_SIZE // governor.MB} MB")
+            return
+
+        expire_uploads()
+        inbox = os.path.basename(inbox_dir)
+        # The full declared length is reserved up front, so parallel uploads cannot overrun a quota
+        with _quota_lock:
+            if stored_bytes(inbox) + length > INBOX_QUOTA:
+                self.send_error(507, f"This session's uploads would exceed {INBOX_QUOTA // governor.MB} MB; "
+                                     "wait for older uploads to expire")
+                return
+            if stored_bytes() + length > TOTAL_QUOTA:
+                self.send_error(507, "The server is out of upload space; please try again later")
+                return
+            upload_id = secrets.token_urlsafe(16)
+            upload_dir = os.path.join(inbox_dir, upload_id)
+            os.makedirs(upload_dir)
+            with open(os.path.join(upload_dir, "upload.json"), "w") as f:
+                json.dump({"name": name, "length": length}, f)
+            open(os.path.join(upload_dir, name + _PARTIAL), "wb").close()
+
+        self._reply(201, {"Location": f"/{inbox}/uploads/{upload_id}", "Upload-Offset": 0})
+
+    def do_HEAD(self):
+        result = self._result()
+        if result is not None:
+            results.serve_file(self, *result)
+            return
+        inbox_dir, upload_id, is_upload = self._route()
+        upload_dir, info = self._load(inbox_dir, upload_id) if is_upload and upload_id else (None, None)
+        if info is None:
+            self.send_error(404)
+            return
+        self._reply(200, {
+            "Upload-Offset": self._offset(upload_dir, info),
+            "Upload-Length": info["length"],
+            "Cache-Control": "no-store",
+        })
+
+    def do_PATCH(self):
+        inbox_dir, upload_id, is_upload = self._route()
+        upload_dir, info = self._load(inbox_dir, upload_id) if is_upload and upload_id else (None, None)
+        if info is None:
+            self.send_error(404)
+            return
+        try:
+            offset = int(self.headers["Upload-Offset"])
+            size = int(self.headers["Content-Length"])
+        except (TypeError, ValueError):
+            self.send_error(400, "Upload-Offset and Content-Length headers required")
+            return
+
+        lock = _upload_locks.setdefault(upload_dir, threading.Lock())
+        if not lock.acquire(blocking=False):
+            current = self._offset(upload_dir, info)
+            self._reply(409, {"Upload-Offset": current}, b"Another request is writing to this upload")
+            return
+        try:
+            current = self._offset(upload_dir, info)
+            if offset != current:
+                self._reply(409, {"Upload-Offset": current}, b"Upload-Offset does not match the data received")
+                return
+            if offset + size > info["length"]:
+                self.send_error(413, "Chunk runs past the declared Upload-Length")
+                return
+
+            partial = os.path.join(upload_dir, info["name"] + _PARTIAL)
+            with open(partial, "ab") as f:
+                remaining = size
+                while remaining:
+                    chunk = self.rfile.read(min(CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break  # client went away; what arrived is kept for the resume
+                    f.write(chunk)
+                    remaining -= len(chunk)
+            current = os.path.getsize(partial)
+            if current == info["length"]:
+                os.replace(partial, os.path.join(upload_dir, info["name"]))
+            self._reply(204, {"Upload-Offset": current})
+        finally:
+            lock.release()
+            if self._offset(upload_dir, info) == info["length"]:
+                _upload_locks.pop(upload_dir, None)  # finished; no more writes to serialize
+
+
+def start_server():
+    """Start the upload server in a background thread; return its port, or None if it could not start"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            os.makedirs(UPLOAD_DIR, exist_ok=True)
+            try:
+                _server = ThreadingHTTPServer((UPLOAD_HOST, UPLOAD_PORT), UploadHandler)
+            except OSError:
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server.server_address[1]
+
+
+def upload_file(path, base_url, chunk_size=8 * CHUNK_SIZE, retries=5, progress=None):
+    """Upload a local file to an inbox URL in chunks, resuming after errors
+
+    base_url is the inbox address shown by the app, e.g.
+    ``http://server:8502/<inbox>/``. Returns the upload URL.
+    """
+    import urllib.error
+    import urllib.request
+
+    def request(method, url, headers, data=None):
+        req = urllib.request.Request(url, data=data, method=method, headers=headers)
+        with urllib.request.urlopen(req) as response:
+            return response.headers
+
+    base_url = base_url.rstrip("/")
+    length = os.path.getsize(path)
+    headers = request("POST", f"{base_url}/uploads", {
+        "Upload-Length": str(length),
+        "Upload-Name": quote(os.path.basename(path)),
+    })
+    upload_url = urljoin(base_url, headers["Location"])
+
+    offset = 0
+    failures = 0
+    with open(path, "rb") as f:
+        while offset < length:
+            f.seek(offset)
+            chunk = f.read(chunk_size)
+            try:
+                headers = request("PATCH", upload_url, {"Upload-Offset": str(offset)}, chunk)
+                offset = int(headers["Upload-Offset"])
+                failures = 0
+            except (urllib.error.URLError, OSError):
+                failures += 1
+                if failures > retries:
+                    raise
+                time.sleep(min(2 ** failures, 30))
+                # Ask the server how much arrived and continue from there
+                offset = int(request("HEAD", upload_url, {})["Upload-Offset"])
+            if progress is not None:
+                progress(offset, length)
+    return upload_url
+
+
+UPLOAD_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Large file upload - Advanced Document Converter</title>
+<style>
+  body { font-family: sans-serif; max-width: 40rem; margin: 3rem auto; color: #182848; }
+  h1 { color: #4b6cb7; }
+  .file { margin: 1rem 0; }
+  progress { width: 100%; }
+</style>
+</head>
+<body>
+<h1>Large file upload</h1>
+<p>Files are written straight to the server's disk in chunks (up to {max_mb} MB each).
+If the connection drops, choose the same file again to continue where it stopped.
+When an upload is finished, go back to the converter and pick it under <b>Large files</b>.</p>
+<input type="file" id="files" multiple accept="{accept}">
+<div id="list"></div>
+<script>
+const CHUNK = 8 * 1024 * 1024;
+const base = location.pathname.replace(/\\/$/, "");
+
+async function upload(file, bar, label) {
+  const key = "adc-upload:" + base + ":" + file.name + ":" + file.size + ":" + file.lastModified;
+  let url = localStorage.getItem(key), offset = 0;
+  if (url) {
+    const r = await fetch(url, {method: "HEAD"});
+    if (r.ok) { offset = +r.headers.get("Upload-Offset"); } else { url = null; }
+  }
+  if (!url) {
+    const r = await fetch(base + "/uploads", {method: "POST", headers: {
+      "Upload-Length": file.size, "Upload-Name": encodeURIComponent(file.name)}});
+    if (!r.ok) throw new Error(r.statusText);
+    url = r.headers.get("Location");
+    localStorage.setItem(key, url);
+  }
+  let failures = 0;
+  while (offset < file.size) {
+    try {
+      const r = await fetch(url, {method: "PATCH", headers: {"Upload-Offset": offset},
+                                  body: file.slice(offset, offset + CHUNK)});
+      if (!r.ok && r.status !== 409) throw new Error(r.statusText);
+      offset = +r.headers.get("Upload-Offset");
+      failures = 0;
+    } catch (e) {
+      if (++failures > 5) throw e;
+      await new Promise(resolve => setTimeout(resolve, 1000 * 2 ** failures));
+      const r = await fetch(url, {method: "HEAD"});
+      if (r.ok) offset = +r.headers.get("Upload-Offset");
+    }
+    bar.value = offset / file.size;
+    label.textContent = file.name + ": " + (offset / 1048576).toFixed(1) + " of " + (file.size / 1048576).toFixed(1) + " MB";
+  }
+  localStorage.removeItem(key);
+  label.textContent = file.name + ": done";
+}
+
+document.getElementById("files").addEventListener("change", event => {
+  for (const file of event.target.files) {
+    const div = document.createElement("div");
+    div.className = "file";
+    const label = document.createElement("div");
+    const bar = document.createElement("progress");
+    div.append(label, bar);
+    document.getElementById("list").append(div);
+    label.textContent = file.name;
+    upload(file, bar, label).catch(e => { label.textContent = file.name + ": failed (" + e.message + "), choose it again to resume"; });
+  }
+});
+</script>
+</body>
+</html>
+"""
@@ -0,0 +1,256 @@
+"""Warm fork server for sandboxed conversions.
+
+Starting a fresh worker for every job means paying for the imports of
+PyMuPDF, python-docx, python-pptx, pandas and ReportLab, font discovery and
+the first-use setup of each library again and again. Instead, one server
+process is started when the app starts. It imports the converters, runs one
+tiny conversion of each kind (``warm_up``) and then waits on a private Unix
+socket. Every job connection is handled by a child forked from that warm
+server. The child applies the job's rlimits, runs the converter, and exits,
+so a crash or leak still only affects that one job.
+
+Jobs name their converter by reference and pass file paths, not documents.
+Results are written to a file chosen by the caller (``run_job``). The
+listening socket lives in a private temporary directory and requires a
+random key only known to the process that started the server.
+
+The server exits when the process that started it goes away (its stdin
+reaches end-of-file).
+"""
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+from io import BytesIO
+from multiprocessing.connection import Client, Listener
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STARTUP_TIMEOUT = 60
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def _address_space_in_use():
+    """Current virtual memory size of this process in bytes (Linux only)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _lower_limit(which, soft, hard):
+    """Set an rlimit without trying to raise an existing hard limit"""
+    current_hard = resource.getrlimit(which)[1]
+    if current_hard != resource.RLIM_INFINITY:
+        hard = min(hard, current_hard)
+        soft = min(soft, hard)
+    resource.setrlimit(which, (soft, hard))
+
+
+def apply_limits(memory_limit, cpu_limit):
+    """Apply rlimits to the current (child) process"""
+    if resource is None:
+        return
+    # The forked child inherits the parent's mappings, so the budget is on top of them
+    address_space = _address_space_in_use() + memory_limit
+    _lower_limit(resource.RLIMIT_AS, address_space, address_space)
+    _lower_limit(resource.RLIMIT_CPU, cpu_limit, cpu_limit + 5)
+
+
+def kill_job(pid):
+    """Kill a job's worker and every process it started (its process group)"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        # The worker has not made its own group yet (or is gone)
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+def run_job(conn, func, args, kwargs, memory_limit, cpu_limit, result_path, deadline=None):
+    """Run one job in the current (child) process and report back on conn
+
+    Sends ("file", None) when a document (a BytesIO, a generator of byte
+    chunks or a docs.ResultFile) was written to result_path, ("ok", result)
+    for any other result and ("error", message) on failure. deadline is the
+    time.monotonic() at which the caller gives up on the job.
+    """
+    import docs
+
+    try:
+        # A group of its own, so kill_job also stops LibreOffice and pool
+        # processes the job started
+        os.setsid()
+        apply_limits(memory_limit, cpu_limit)
+        docs.JOB_DEADLINE = deadline
+        # Scratch files go next to the result: moving them into place is a
+        # rename, and whatever a killed job leaves behind expires with it
+        docs.WORK_DIR = os.path.dirname(result_path)
+        result = func(*args, **kwargs)
+        if isinstance(result, docs.ResultFile):
+            # Already on disk: moved into place, not copied
+            result.move_to(result_path)
+            conn.send(("file", None))
+        elif isinstance(result, BytesIO):
+            # Hand documents back through a file instead of pickling them
+            with open(result_path, "wb") as f:
+                f.write(result.getbuffer())
+            conn.send(("file", None))
+        elif isinstance(result, types.GeneratorType):
+            # Streamed output (e.g. text export) is written as it is produced
+            with open(result_path, "wb") as f:
+                for chunk in result:
+                    f.write(chunk)
+            conn.send(("file", None))
+        else:
+            conn.send(("ok", result))
+    except MemoryError:
+        conn.send(("error", "The conversion ran out of memory."))
+    except BaseException as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def warm_up():
+    """Import the converters and run one tiny conversion of each kind
+
+    Lazy imports, font scanning and first-use caches inside the libraries are
+    paid for here, once, instead of in every worker.
+    """
+    import fitz  # PyMuPDF
+
+    import backends
+    import docs
+
+    pdf_document = fitz.open()
+    page = pdf_document.new_page(width=200, height=200)
+    page.insert_text((20, 40), "Warm up")
+    sample_pdf = pdf_document.tobytes()
+    pdf_document.close()
+
+    docs.pdf_to_word(sample_pdf)
+    docs.pdf_to_pptx(sample_pdf)
+    docs.pdf_to_excel(sample_pdf)
+    docs.jpg_to_pdf([docs.pdf_to_jpg(sample_pdf).getvalue()])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        word_path = os.path.join(tmp, "warmup.docx")
+        with open(word_path, "wb") as f:
+            f.write(docs.pdf_to_word(sample_pdf).getvalue())
+        backends.convert("word_to_pdf", word_path, backend="python")
+
+        excel_path = os.path.join(tmp, "warmup.xlsx")
+        with open(excel_path, "wb") as f:
+            f.write(docs.pdf_to_excel(sample_pdf).getvalue())
+        backends.convert("excel_to_pdf", excel_path, backend="python")
+
+
+def _exit_with_parent(address):
+    """Stop the server once the process that started it closes our stdin"""
+    sys.stdin.buffer.read()
+    shutil.rmtree(os.path.dirname(address), ignore_errors=True)
+    os._exit(0)
+
+
+def _handle(conn):
+    """Body of a forked worker: receive one job, run it and exit"""
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    status = 0
+    try:
+        job = conn.recv()
+        conn.send(os.getpid())
+        run_job(conn, *job)
+    except BaseException:
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def serve(address, authkey):
+    """Warm up, then fork one worker per job connection until stdin closes"""
+    try:
+        warm_up()
+    except Exception as e:
+        # A cold worker is still a working worker
+        print(f"Worker warm-up failed: {e}", file=sys.stderr)
+
+    # Workers are not waited for; let the kernel reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    threading.Thread(target=_exit_with_parent, args=(address,), daemon=True).start()
+
+    listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    with open(address + ".ready", "w"):
+        pass
+    while True:
+        try:
+            conn = listener.accept()
+        except Exception:
+            # Failed handshakes (wrong key, dropped client) only lose that connection
+            continue
+        if os.fork() == 0:
+            _handle(conn)
+        conn.close()
+
+
+def ensure_running():
+    """Start the warm server if it is not running and return (address, authkey)"""
+    global _server
+    with _server_lock:
+        if _server is not None and _server[0].poll() is None:
+            return _server[1:]
+
+        # mkdtemp creates the directory readable by this user only
+        address = os.path.join(tempfile.mkdtemp(prefix="adc-workers-"), "workers.sock")
+        authkey = os.urandom(32)
+        here = os.path.dirname(os.path.abspath(__file__))
+        process = subprocess.Popen(
+            [sys.executable, "-c",
+             "import sys; sys.path.insert(0, sys.argv[1]); import workers; workers.main()",
+             here, address],
+            stdin=subprocess.PIPE,
+            env=dict(os.environ, ADC_WORKER_KEY=authkey.hex()),
+        )
+
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while not os.path.exists(address + ".ready"):
+            if process.poll() is not None:
+                raise RuntimeError(f"The worker server exited during start-up (exit code {process.returncode}).")
+            if time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("The worker server did not start in time.")
+            time.sleep(0.02)
+
+        _server = (process, address, authkey)
+        return _server[1:]
+
+
+def submit(func, args, kwargs, memory_limit, cpu_limit, result_path, deadline=None):
+    """Send a job to a fresh warm worker and return (connection, worker pid)"""
+    address, authkey = ensure_running()
+    conn = Client(address, family="AF_UNIX", authkey=authkey)
+    try:
+        conn.send((func, args, kwargs, memory_limit, cpu_limit, result_path, deadline))
+        return conn, conn.recv()
+    except BaseException:
+        conn.close()
+        raise
+
+
+def main():
+    address = sys.argv[2]
+    authkey = bytes.fromhex(os.environ.pop("ADC_WORKER_KEY"))
+    serve(address, authkey)